@@ -8,6 +8,7 @@ from flask_moment import Moment
 from flask_babel import Babel
 from elasticsearch import Elasticsearch
 from celery import Celery, Task
+from redis import Redis
 import os
 
 
@@ -46,6 +47,16 @@ def create_app(config_class=get_config_class()) -> Flask:
             "broker_url": app.config["REDIS_URL"],
             "result_backend": app.config["REDIS_URL"],
             "task_ignore_result": True,
+            "beat_schedule": {
+                "prune-notifications": {
+                    "task": "app.tasks.prune_notifications",
+                    "schedule": app.config["NOTIFICATION_PRUNE_INTERVAL"],
+                },
+                "drain-search-outbox": {
+                    "task": "app.tasks.drain_search_outbox",
+                    "schedule": app.config["SEARCH_OUTBOX_INTERVAL"],
+                },
+            },
         },
     )
     config_class.init_app(app)
@@ -57,6 +68,7 @@ def create_app(config_class=get_config_class()) -> Flask:
     moment.init_app(app)
     babel.init_app(app, locale_selector=get_locale)
     app.elasticsearch = Elasticsearch(app.config['ELASTICSEARCH_URL']) if app.config['ELASTICSEARCH_URL'] else None
+    app.redis = Redis.from_url(app.config['CACHE_REDIS_URL']) if app.config['CACHE_REDIS_URL'] else None
     celery_init_app(app)
 
     from app.errors import bp as errors_bp
@@ -71,8 +83,12 @@ def create_app(config_class=get_config_class()) -> Flask:
     from app.api import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
-    from app.main.group import GroupAPI, GroupsAPI, MembersAPI
+    from app.cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
+
+    from app.main.group import GroupAPI, GroupsAPI, MembersAPI, BroadcastAPI
     app.add_url_rule("/groups/<int:group_id>", view_func=GroupAPI.as_view("group"))
+    app.add_url_rule("/groups/<int:group_id>/broadcast", view_func=BroadcastAPI.as_view("group_broadcast"))
     app.add_url_rule("/groups", view_func=GroupsAPI.as_view("groups"))
     app.add_url_rule("/members", view_func=MembersAPI.as_view("members"))
 
@@ -80,3 +96,4 @@ def create_app(config_class=get_config_class()) -> Flask:
 
 
 from app.models import mixins
+from app import feeds, users, usernames
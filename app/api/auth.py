@@ -12,6 +12,7 @@ token_auth = HTTPTokenAuth()
 def verify_password(username, password):
     user = db.session.scalar(sa.select(User).filter_by(username=username))
     if user and user.check_password(password):
+        db.session.commit()
         return user
 
 
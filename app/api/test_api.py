@@ -102,6 +102,44 @@ def test_get_users(auth, client):
     assert response.json["items"][0]['username'] == 'test'
 
 
+def test_get_users_cursor(auth, client):
+    token = auth.login().json['token']
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get('/api/users?per_page=1&after=&include_total=1', headers=headers)
+    assert response.status_code == 200
+    assert response.json["items"][0]['username'] == 'test'
+    assert response.json["_meta"]['total_items'] == 2
+    assert response.json["_links"]['prev'] is None
+    response = client.get(response.json["_links"]['next'], headers=headers)
+    assert response.json["items"][0]['username'] == 'test2'
+    assert response.json["_links"]['next'] is None
+    response = client.get(response.json["_links"]['prev'], headers=headers)
+    assert response.json["items"][0]['username'] == 'test'
+    assert response.json["_links"]['prev'] is None
+
+
+def test_get_users_queries(app, auth, client):
+    with app.app_context():
+        db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(30)])
+        db.session.commit()
+    token = auth.login().json['token']
+    headers = {"Authorization": f"Bearer {token}"}
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    with app.app_context():
+        sa.event.listen(db.engine, 'before_cursor_execute', listener)
+    small = client.get('/api/users?per_page=2', headers=headers)
+    small_count = len(statements)
+    statements.clear()
+    large = client.get('/api/users?per_page=30', headers=headers)
+    assert len(statements) == small_count
+    assert len(large.json['items']) == 30
+    item = large.json['items'][5]
+    assert item['_links']['self'] == f"/api/users/{item['id']}"
+    assert item['_links']['followers'] == f"/api/users/{item['id']}/followers"
+    assert small.json['items'][0] == large.json['items'][0]
+
+
 def test_update_user(app, auth, client):
     token = auth.login().json['token']
     response = client.put('/api/users/1', json={'about_me': 'Test app'}, headers={"Authorization": f"Bearer {token}"})
@@ -127,6 +165,23 @@ def test_get_followers(auth, client):
     assert response.json["items"][0]['username'] == 'test2'
 
 
+def test_signed_token(app, auth, client):
+    app.config['API_TOKEN_FORMAT'] = 'signed'
+    token = auth.login().json['token']
+    headers = {"Authorization": f"Bearer {token}"}
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    with app.app_context():
+        sa.event.listen(db.engine, 'before_cursor_execute', listener)
+    assert client.put('/api/users/2', json={}, headers=headers).status_code == 403
+    assert not statements
+    assert client.get('/api/users/1', headers=headers).status_code == 200
+    assert client.delete('/api/tokens', headers=headers).status_code == 204
+    assert client.get('/api/users/1', headers=headers).status_code == 401
+    assert client.get('/api/users/1', headers={"Authorization": f"Bearer {token}x"}).status_code == 401
+    assert client.get('/api/users/1', headers={"Authorization": f"Bearer {auth.login().json['token']}"}).status_code == 200
+
+
 def test_logout(app, auth, client):
     token = auth.login().json['token']
     response = client.delete('/api/tokens', headers={"Authorization": f"Bearer {token}"})
@@ -5,6 +5,18 @@ from flask import request, url_for, abort
 import sqlalchemy as sa
 from app.api.errors import bad_request
 from app.api.auth import token_auth
+from app.pagination import count_strategy, use_keyset
+
+
+def user_collection(query, endpoint, **kwargs):
+    per_page = min(request.args.get('per_page', 10, type=int), 100)
+    if use_keyset():
+        return User.to_cursor_collection_dict(query, [User.id], per_page, endpoint, request.args.get('after'),
+                                              request.args.get('before'),
+                                              request.args.get('include_total', 0, type=int) == 1, **kwargs)
+    page = request.args.get('page', 1, type=int)
+    count_key = f"{endpoint}:{kwargs.get('user_id', '')}"
+    return User.to_collection_dict(query, page, per_page, endpoint, count_strategy(endpoint), count_key, **kwargs)
 
 
 @bp.get('/users/<int:user_id>')
@@ -16,27 +28,21 @@ def get_user(user_id):
 @bp.get('/users')
 @token_auth.login_required
 def get_users():
-    page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    return User.to_collection_dict(sa.select(User), page, per_page, 'api.get_users')
+    return user_collection(sa.select(User), 'api.get_users')
 
 
 @bp.get('/users/<int:user_id>/followers')
 @token_auth.login_required
 def get_followers(user_id):
     user = db.get_or_404(User, user_id)
-    page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    return User.to_collection_dict(user.followers.select(), page, per_page, 'api.get_followers', user_id=user_id)
+    return user_collection(user.followers.select(), 'api.get_followers', user_id=user_id)
 
 
 @bp.get('/users/<int:user_id>/following')
 @token_auth.login_required
 def get_following(user_id):
     user = db.get_or_404(User, user_id)
-    page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    return User.to_collection_dict(user.following.select(), page, per_page, 'api.get_following', user_id=user_id)
+    return user_collection(user.following.select(), 'api.get_following', user_id=user_id)
 
 
 @bp.post('/users')
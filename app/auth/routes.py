@@ -20,6 +20,7 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash('Проверьте имя пользователя или пароль')
             return redirect(url_for('auth.login'))
+        db.session.commit()
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or urlsplit(next_page).netloc != '':
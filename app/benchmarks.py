@@ -0,0 +1,51 @@
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import sqlalchemy as sa
+
+from app import db
+from app.passwords import passwords
+from app.models.user import User, followers, FOLLOWING_POSTS_STRATEGIES
+
+
+def busiest_followers(count):
+    query = (sa.select(User)
+             .join(followers, followers.c.follower_id == User.id)
+             .group_by(User.id)
+             .order_by(sa.func.count().desc())
+             .limit(count))
+    return db.session.scalars(query).all()
+
+
+def benchmark_following_posts(users, per_page, pages, repeat):
+    timings = {strategy: [] for strategy in FOLLOWING_POSTS_STRATEGIES}
+    mismatches = set()
+    for user in users:
+        for page in range(1, pages + 1):
+            expected = None
+            for strategy in FOLLOWING_POSTS_STRATEGIES:
+                query = (user.following_posts(page * per_page + 1, strategy)
+                         .limit(per_page).offset((page - 1) * per_page))
+                for _ in range(repeat):
+                    start = perf_counter()
+                    ids = [post.id for post in db.session.scalars(query)]
+                    timings[strategy].append(perf_counter() - start)
+                if expected is None:
+                    expected = ids
+                elif ids != expected:
+                    mismatches.add(strategy)
+    medians = {strategy: statistics.median(values) for strategy, values in timings.items() if values}
+    candidates = {strategy: value for strategy, value in medians.items() if strategy not in mismatches}
+    best = min(candidates, key=candidates.get) if candidates else None
+    return medians, mismatches, best
+
+
+def benchmark_passwords(logins, concurrency):
+    hasher = passwords()
+    password_hash = hasher.hash('benchmark')
+    with ThreadPoolExecutor(concurrency) as clients:
+        start = perf_counter()
+        results = list(clients.map(lambda _: hasher.verify(password_hash, 'benchmark'), range(logins)))
+        elapsed = perf_counter() - start
+    return logins / elapsed, elapsed / logins * concurrency, all(results)
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from time import monotonic
+
+import sqlalchemy as sa
+
+from app import db
+from app.events import publish_after_commit
+from app.models.conversation import Conversation, ConversationMember
+from app.models.group import Membership
+from app.models.message import Message
+from app.models.notification import Notification
+from app.models.user import User
+
+
+def member_count(group_id, sender_id):
+    query = sa.select(sa.func.count()).select_from(Membership).where(Membership.group_id == group_id,
+                                                                     Membership.user_id != sender_id)
+    return db.session.scalar(query)
+
+
+def member_chunks(group_id, sender_id, size):
+    last = 0
+    while True:
+        query = (sa.select(Membership.user_id)
+                 .where(Membership.group_id == group_id, Membership.user_id != sender_id, Membership.user_id > last)
+                 .order_by(Membership.user_id)
+                 .limit(size))
+        ids = db.session.scalars(query).all()
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def deliver(sender_id, recipient_ids, body, timestamp):
+    low = sa.case((User.id < sender_id, User.id), else_=sender_id)
+    high = sa.case((User.id < sender_id, sender_id), else_=User.id)
+    recipients = sa.and_(User.id.in_(recipient_ids), User.id != sender_id)
+    pairs = sa.or_(sa.and_(Conversation.user1_id == sender_id, Conversation.user2_id.in_(recipient_ids)),
+                   sa.and_(Conversation.user2_id == sender_id, Conversation.user1_id.in_(recipient_ids)))
+    same_pair = sa.and_(Conversation.user1_id == low, Conversation.user2_id == high)
+
+    db.session.execute(sa.insert(Conversation).from_select(
+        ['user1_id', 'user2_id'],
+        sa.select(low, high).where(recipients, ~sa.exists().where(same_pair))
+    ))
+    no_members = ~sa.exists().where(ConversationMember.conversation_id == Conversation.id)
+    db.session.execute(sa.insert(ConversationMember).from_select(
+        ['conversation_id', 'user_id', 'peer_id'],
+        sa.union_all(
+            sa.select(Conversation.id, Conversation.user1_id, Conversation.user2_id).where(pairs, no_members),
+            sa.select(Conversation.id, Conversation.user2_id, Conversation.user1_id).where(pairs, no_members),
+        ),
+        include_defaults=False
+    ))
+    result = db.session.execute(sa.insert(Message).from_select(
+        ['sender_id', 'recipient_id', 'body', 'timestamp', 'conversation_id'],
+        sa.select(sa.literal(sender_id), User.id, sa.literal(body, sa.String), sa.literal(timestamp, sa.DateTime),
+                  Conversation.id)
+        .join(Conversation, same_pair)
+        .where(recipients)
+    ))
+
+    db.session.execute(sa.update(User).where(recipients).values(
+        unread_message_counter=User.unread_message_counter + 1
+    ).execution_options(synchronize_session=False))
+    last_message = (sa.select(Message.id)
+                    .where(Message.conversation_id == ConversationMember.conversation_id)
+                    .order_by(Message.timestamp.desc(), Message.id.desc())
+                    .limit(1)
+                    .scalar_subquery())
+    db.session.execute(sa.update(ConversationMember).where(
+        ConversationMember.conversation_id.in_(sa.select(Conversation.id).where(pairs))
+    ).values(
+        last_message_id=last_message,
+        last_message_at=timestamp,
+        unread_count=ConversationMember.unread_count + sa.case((ConversationMember.user_id != sender_id, 1), else_=0),
+    ).execution_options(synchronize_session=False))
+
+    notifications = Notification.upsert_from_select(
+        'unread_message_count',
+        sa.select(User.id, sa.cast(User.unread_message_counter, sa.Text)).where(recipients)
+    )
+    for notification in notifications:
+        publish_after_commit(notification.user_id, notification.to_dict())
+    return result.rowcount
+
+
+def broadcast(group_id, sender_id, body, chunk_size, on_chunk=None):
+    timestamp = datetime.now(timezone.utc)
+    start = monotonic()
+    sent = 0
+    for ids in member_chunks(group_id, sender_id, chunk_size):
+        sent += deliver(sender_id, ids, body, timestamp)
+        db.session.commit()
+        if on_chunk:
+            on_chunk(sent)
+    return sent, monotonic() - start
@@ -0,0 +1,88 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from flask import current_app as app
+from redis.exceptions import RedisError
+
+
+class LocalCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.data[key] = (value, monotonic() + (ttl or self.ttl))
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value, _ = self.data.get(key, (0, None))
+            self.data[key] = (value + 1, float('inf'))
+            self.data.move_to_end(key)
+            return value + 1
+
+
+class RedisCache:
+    def __init__(self, redis, prefix, ttl):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key):
+        try:
+            value = self.redis.get(self._key(key))
+        except RedisError:
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.redis.set(self._key(key), json.dumps(value), ex=ttl or self.ttl)
+        except RedisError:
+            pass
+
+    def delete(self, *keys):
+        try:
+            self.redis.delete(*[self._key(key) for key in keys])
+        except RedisError:
+            pass
+
+    def incr(self, key):
+        try:
+            return self.redis.incr(self._key(key))
+        except RedisError:
+            return None
+
+
+def get_cache(name, max_size, ttl):
+    caches = app.extensions.setdefault('caches', {})
+    if name not in caches:
+        caches[name] = RedisCache(app.redis, name, ttl) if app.redis else LocalCache(max_size, ttl)
+    return caches[name]
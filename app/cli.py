@@ -0,0 +1,93 @@
+from time import monotonic
+
+import click
+from flask import Blueprint, current_app as app
+
+from app import db
+from app.benchmarks import benchmark_following_posts, benchmark_passwords, busiest_followers
+from app.models.timeline import TimelineEntry
+from app.models.user import User
+from app.search import searchable_models
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.group()
+def timeline():
+    """Материализованная лента подписок."""
+    pass
+
+
+@timeline.command()
+def rebuild():
+    """Пересобрать ленты всех пользователей."""
+    TimelineEntry.rebuild()
+    db.session.commit()
+    click.echo('Ленты пересобраны')
+
+
+@bp.cli.group()
+def counters():
+    """Счетчики пользователей."""
+    pass
+
+
+@counters.command()
+def reconcile():
+    """Пересчитать счетчики постов, подписок и непрочитанных сообщений."""
+    User.reconcile_counters()
+    db.session.commit()
+    click.echo('Счетчики пересчитаны')
+
+
+@bp.cli.group()
+def search():
+    """Поисковый индекс."""
+    pass
+
+
+@search.command()
+@click.option('--processes', type=int, help='Количество процессов индексации.')
+def reindex(processes):
+    """Пересобрать поисковый индекс без остановки поиска."""
+    processes = processes or app.config['SEARCH_REINDEX_PROCESSES']
+    for index, model in searchable_models().items():
+        start = monotonic()
+        count, errors = model.reindex(processes)
+        click.echo(f'{index}: {count} документов за {monotonic() - start:.1f} с, ошибок: {len(errors)}')
+
+
+@bp.cli.group()
+def bench():
+    """Замеры производительности."""
+    pass
+
+
+@bench.command('following-posts')
+@click.option('--users', default=20, help='Количество пользователей с наибольшим числом подписок.')
+@click.option('--pages', default=3, help='Количество страниц ленты для каждого пользователя.')
+@click.option('--repeat', default=5, help='Количество повторов каждого запроса.')
+def bench_following_posts(users, pages, repeat):
+    """Сравнить стратегии запроса ленты подписок."""
+    sample = busiest_followers(users)
+    if not sample:
+        click.echo('Нет пользователей с подписками')
+        return
+    medians, mismatches, best = benchmark_following_posts(sample, app.config['POSTS_PER_PAGE'], pages, repeat)
+    for strategy, value in sorted(medians.items(), key=lambda item: item[1]):
+        note = ' (результат отличается от join)' if strategy in mismatches else ''
+        click.echo(f'{strategy:>8}: {value * 1000:.3f} мс{note}')
+    if best:
+        click.echo(f'Рекомендуется FOLLOWING_POSTS_STRATEGY={best}')
+
+
+@bench.command('passwords')
+@click.option('--logins', default=50, help='Количество проверок пароля.')
+@click.option('--concurrency', default=8, help='Количество одновременных входов.')
+def bench_passwords(logins, concurrency):
+    """Измерить пропускную способность проверки паролей."""
+    rate, latency, ok = benchmark_passwords(logins, concurrency)
+    click.echo(f'{app.config["PASSWORD_HASH_METHOD"]}, потоков: {app.config["PASSWORD_HASH_WORKERS"]}')
+    click.echo(f'{rate:.1f} входов/с на процесс, {latency * 1000:.1f} мс на вход')
+    if not ok:
+        click.echo('Ошибка: проверка пароля не прошла')
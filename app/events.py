@@ -0,0 +1,111 @@
+import json
+from collections import defaultdict
+from queue import Queue, Empty
+from threading import Lock
+
+from flask import current_app as app
+from redis import Redis
+from redis.exceptions import RedisError
+
+from app import db
+
+
+class LocalSubscription:
+    def __init__(self, bus, user_id):
+        self.bus = bus
+        self.user_id = user_id
+        self.queue = Queue()
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class LocalBus:
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.lock = Lock()
+
+    def subscribe(self, user_id):
+        subscription = LocalSubscription(self, user_id)
+        with self.lock:
+            self.subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions[subscription.user_id]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscriptions[subscription.user_id]
+
+    def publish(self, user_id, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.queue.put(message)
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout):
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBus:
+    def __init__(self, redis):
+        self.redis = redis
+
+    @staticmethod
+    def channel(user_id):
+        return f'notifications:{user_id}'
+
+    def subscribe(self, user_id):
+        pubsub = self.redis.pubsub()
+        pubsub.subscribe(self.channel(user_id))
+        return RedisSubscription(pubsub)
+
+    def publish(self, user_id, message):
+        self.redis.publish(self.channel(user_id), json.dumps(message))
+
+
+def notification_bus():
+    if 'notification_bus' not in app.extensions:
+        app.extensions['notification_bus'] = LocalBus() if app.testing else RedisBus(
+            Redis.from_url(app.config['REDIS_URL']))
+    return app.extensions['notification_bus']
+
+
+def publish_after_commit(user_id, message):
+    db.session.info.setdefault('notifications', []).append((user_id, message))
+
+
+def after_commit(session):
+    notifications = session.info.pop('notifications', None)
+    if not notifications:
+        return
+    bus = notification_bus()
+    try:
+        for user_id, message in notifications:
+            bus.publish(user_id, message)
+    except RedisError as e:
+        app.logger.warning(f'Notification bus is unavailable: {e}')
+
+
+def after_rollback(session):
+    session.info.pop('notifications', None)
+
+
+db.event.listen(db.session, 'after_commit', after_commit)
+db.event.listen(db.session, 'after_rollback', after_rollback)
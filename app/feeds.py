@@ -0,0 +1,139 @@
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+import sqlalchemy as sa
+from flask import current_app as app
+from redis.exceptions import RedisError
+
+from app import db
+from app.models.post import Post
+
+
+class LocalRecentPosts:
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.ids = deque(maxlen=size)
+        self.loaded_at = None
+        self.lock = Lock()
+
+    def load(self, ids):
+        with self.lock:
+            self.ids.clear()
+            self.ids.extend(ids)
+            self.loaded_at = monotonic()
+
+    def push(self, ids):
+        with self.lock:
+            if self.loaded_at is not None:
+                self.ids.extendleft(ids)
+
+    def remove(self, ids):
+        with self.lock:
+            for id in ids:
+                if id in self.ids:
+                    self.ids.remove(id)
+
+    def is_warm(self):
+        return self.loaded_at is not None and monotonic() - self.loaded_at < self.ttl
+
+    def slice(self, start, stop):
+        with self.lock:
+            return list(self.ids)[start:stop], len(self.ids)
+
+
+class RedisRecentPosts:
+    key = 'explore:recent_posts'
+
+    def __init__(self, redis, size, ttl):
+        self.redis = redis
+        self.size = size
+        self.ttl = ttl
+
+    def load(self, ids):
+        pipeline = self.redis.pipeline()
+        pipeline.delete(self.key)
+        if ids:
+            pipeline.rpush(self.key, *ids)
+            pipeline.expire(self.key, self.ttl)
+        pipeline.execute()
+
+    def push(self, ids):
+        pipeline = self.redis.pipeline()
+        pipeline.lpushx(self.key, *ids)
+        pipeline.ltrim(self.key, 0, self.size - 1)
+        pipeline.execute()
+
+    def remove(self, ids):
+        pipeline = self.redis.pipeline()
+        for id in ids:
+            pipeline.lrem(self.key, 0, id)
+        pipeline.execute()
+
+    def is_warm(self):
+        return self.redis.exists(self.key)
+
+    def slice(self, start, stop):
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(self.key, start, stop - 1)
+        pipeline.llen(self.key)
+        ids, length = pipeline.execute()
+        return [int(id) for id in ids], length
+
+
+def recent_posts():
+    if 'recent_posts' not in app.extensions:
+        size, ttl = app.config['EXPLORE_CACHE_SIZE'], app.config['EXPLORE_CACHE_TTL']
+        app.extensions['recent_posts'] = RedisRecentPosts(app.redis, size, ttl) if app.redis else LocalRecentPosts(
+            size, ttl)
+    return app.extensions['recent_posts']
+
+
+def explore_page(page, per_page):
+    if page > app.config['EXPLORE_CACHE_PAGES']:
+        return None
+    buffer = recent_posts()
+    try:
+        if not buffer.is_warm():
+            query = sa.select(Post.id).order_by(Post.timestamp.desc(), Post.id.desc()).limit(buffer.size)
+            buffer.load(db.session.scalars(query).all())
+        ids, length = buffer.slice((page - 1) * per_page, page * per_page)
+    except RedisError as e:
+        app.logger.warning(f'Explore cache is unavailable: {e}')
+        return None
+    if length <= page * per_page:
+        return None
+    query = sa.select(Post).where(Post.id.in_(ids))
+    posts = {post.id: post for post in db.session.scalars(query)}
+    return [posts[id] for id in ids if id in posts]
+
+
+def after_flush(session, flush_context):
+    changes = session.info.setdefault('recent_posts', {'add': [], 'delete': []})
+    changes['add'].extend((obj.timestamp, obj.id) for obj in session.new if isinstance(obj, Post))
+    changes['delete'].extend(obj.id for obj in session.deleted if isinstance(obj, Post))
+
+
+def after_commit(session):
+    changes = session.info.pop('recent_posts', None)
+    if not changes or not (changes['add'] or changes['delete']):
+        return
+    buffer = recent_posts()
+    added = [id for timestamp, id in sorted(changes['add'])]
+    try:
+        if changes['delete']:
+            buffer.remove(changes['delete'])
+        if added:
+            buffer.push(added)
+    except RedisError as e:
+        app.logger.warning(f'Explore cache is unavailable: {e}')
+
+
+def after_rollback(session):
+    session.info.pop('recent_posts', None)
+
+
+db.event.listen(db.session, 'after_flush', after_flush)
+db.event.listen(db.session, 'after_commit', after_commit)
+db.event.listen(db.session, 'after_rollback', after_rollback)
@@ -1,8 +1,11 @@
 from flask.views import MethodView
-from flask import request, url_for, abort, jsonify
+from flask import request, url_for, abort, jsonify, current_app as app
+from flask_login import current_user, login_required
 from app.models.group import Group, Membership, Role
 from app.models.user import User
 from app import db
+from app.broadcast import broadcast, member_count
+from app.tasks import broadcast_task
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 
@@ -129,3 +132,21 @@ class MembersAPI(MethodView):
                 return {"message": "Пользователя нет в группе"}
         else:
             abort(422, "Введите пользователя и группу")
+
+
+class BroadcastAPI(MethodView):
+    init_every_request = False
+    decorators = [login_required]
+
+    def post(self, group_id):
+        group: Group = db.get_or_404(Group, group_id)
+        if db.session.get(Membership, (current_user.id, group.id)) is None:
+            abort(403)
+        body: str = request.json.get("body")
+        if not body or len(body) > 140:
+            abort(422, "Введите сообщение до 140 символов")
+        if member_count(group.id, current_user.id) <= app.config["GROUP_BROADCAST_SYNC_LIMIT"]:
+            sent, _ = broadcast(group.id, current_user.id, body, app.config["GROUP_BROADCAST_CHUNK_SIZE"])
+            return {"message": f"Отправлено сообщений: {sent}"}
+        task = current_user.launch_task(broadcast_task, "Рассылка сообщения группе...", group.id, body)
+        return {"message": "Рассылка запущена", "task_id": task.id}, 202
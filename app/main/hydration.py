@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+from datetime import datetime
+from hashlib import md5
+from typing import Optional
+
+import sqlalchemy as sa
+
+from app import db
+from app.models.message import Message
+from app.models.user import User, followers
+from app.presence import presence, fresher
+
+
+@dataclass(frozen=True)
+class AuthorView:
+    id: int
+    username: str
+    email_digest: str
+    about_me: Optional[str]
+    last_seen: Optional[datetime]
+    is_following: bool
+    post_count: int
+    follower_count: int
+    following_count: int
+
+    def avatar(self, size):
+        return f'https://www.gravatar.com/avatar/{self.email_digest}?d=identicon&s={size}'
+
+
+@dataclass(frozen=True)
+class PostView:
+    id: int
+    body: str
+    timestamp: datetime
+    language: Optional[str]
+    author: AuthorView
+
+
+@dataclass(frozen=True)
+class ConversationView:
+    id: int
+    peer: AuthorView
+    last_message: Optional[str]
+    last_message_at: Optional[datetime]
+    last_message_mine: bool
+    unread_count: int
+
+
+def hydrate_users(ids, viewer, users=None):
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+    if users is None:
+        users = db.session.scalars(sa.select(User).where(User.id.in_(ids))).all()
+    following = set(db.session.scalars(
+        sa.select(followers.c.followed_id).where(followers.c.follower_id == viewer.id,
+                                                 followers.c.followed_id.in_(ids))))
+    seen = presence().last_seen(ids)
+    return {user.id: AuthorView(
+        id=user.id,
+        username=user.username,
+        email_digest=md5(user.email.lower().encode('utf-8')).hexdigest(),
+        about_me=user.about_me,
+        last_seen=fresher(user.last_seen, seen.get(user.id)),
+        is_following=user.id in following,
+        post_count=user.post_counter,
+        follower_count=user.follower_counter,
+        following_count=user.following_counter,
+    ) for user in users}
+
+
+def hydrate_posts(items, viewer, author_key='user_id', users=None):
+    items = list(items)
+    authors = hydrate_users([getattr(item, author_key) for item in items], viewer, users)
+    return [PostView(
+        id=item.id,
+        body=item.body,
+        timestamp=item.timestamp,
+        language=getattr(item, 'language', ''),
+        author=authors[getattr(item, author_key)],
+    ) for item in items]
+
+
+def hydrate_conversations(members, viewer):
+    members = list(members)
+    peers = hydrate_users([member.peer_id for member in members], viewer)
+    ids = [member.last_message_id for member in members if member.last_message_id]
+    query = sa.select(Message.id, Message.sender_id, Message.body).where(Message.id.in_(ids))
+    messages = {message.id: message for message in db.session.execute(query)} if ids else {}
+    views = []
+    for member in members:
+        last = messages.get(member.last_message_id)
+        views.append(ConversationView(
+            id=member.conversation_id,
+            peer=peers[member.peer_id],
+            last_message=last.body if last else None,
+            last_message_at=member.last_message_at,
+            last_message_mine=last is not None and last.sender_id == viewer.id,
+            unread_count=member.unread_count,
+        ))
+    return views
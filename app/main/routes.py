@@ -1,7 +1,7 @@
 from celery.result import AsyncResult
 
 from app import db
-from flask import request, render_template, flash, redirect, url_for, g, current_app as app
+from flask import request, render_template, flash, redirect, url_for, g, abort, Response, current_app as app
 from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm, MessageForm
 
 from flask_login import current_user, login_required
@@ -9,11 +9,21 @@ import sqlalchemy as sa
 from app.models.user import User
 from app.models.post import Post
 from app.models.message import Message
+from app.models.conversation import Conversation, ConversationMember
 from app.models.notification import Notification
 
+import json
 from datetime import datetime, timezone
+from time import monotonic
 from langdetect import detect, LangDetectException
-from app.translate import translate
+from app.translate import translate, translate_many
+from app.pagination import paginate, use_keyset
+from app.feeds import explore_page
+from app.main.hydration import hydrate_posts, hydrate_users, hydrate_conversations
+from app.presence import presence
+from app.events import notification_bus
+from app.users import find_user
+from app.usernames import complete_usernames
 from flask_babel import get_locale
 from app.main import bp
 import sqlalchemy.orm as so
@@ -24,8 +34,7 @@ from app.tasks import export_posts_task
 @bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        presence().touch(current_user.id)
         g.search_form = SearchForm()
     g.locale = str(get_locale())
 
@@ -47,12 +56,9 @@ def index():
         flash('Запись успешно опубликована')
         return redirect(url_for('main.index'))
     app.logger.info(f'{request.method} request to {request.path}')
-    page = request.args.get('page', 1, type=int)
-    posts = db.paginate(current_user.following_posts(), page=page,
-                        per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('main.index', page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) if posts.has_prev else None
-    return render_template('index.html', title='Главная', posts=posts.items,
+    limit = None if use_keyset() else request.args.get('page', 1, type=int) * app.config['POSTS_PER_PAGE'] + 1
+    posts, next_url, prev_url = paginate(current_user.home_timeline(limit), 'main.index')
+    return render_template('index.html', title='Главная', posts=hydrate_posts(posts.items, current_user),
                            form=form, next_url=next_url, prev_url=prev_url)
 
 
@@ -60,26 +66,26 @@ def index():
 @login_required
 def explore():
     page = request.args.get('page', 1, type=int)
-    query = sa.select(Post).options(so.selectinload(Post.author)).order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('main.explore', page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.explore', page=posts.prev_num) if posts.has_prev else None
-    return render_template('index.html', title='Все записи', posts=posts,
+    posts = None if use_keyset() else explore_page(page, app.config['POSTS_PER_PAGE'])
+    if posts is not None:
+        next_url = url_for('main.explore', page=page + 1)
+        prev_url = url_for('main.explore', page=page - 1) if page > 1 else None
+    else:
+        query = sa.select(Post).order_by(Post.timestamp.desc(), Post.id.desc())
+        posts, next_url, prev_url = paginate(query, 'main.explore')
+    return render_template('index.html', title='Все записи', posts=hydrate_posts(posts, current_user),
                            next_url=next_url, prev_url=prev_url)
 
 
 @bp.route('/user/<username>')
 @login_required
 def user(username: str):
-    user = db.first_or_404(sa.select(User).filter_by(username=username))
-    page = request.args.get('page', 1, type=int)
-    query = user.posts.select().order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('main.user', username=user.username, page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.user', username=user.username, page=posts.prev_num) if posts.has_prev else None
+    user = find_user(username) or abort(404)
+    query = sa.select(Post).where(Post.user_id == user.id).order_by(Post.timestamp.desc())
+    posts, next_url, prev_url = paginate(query, 'main.user', username=user.username)
     form = EmptyForm()
-    return render_template('user.html', user=user, posts=posts.items,
+    profile = hydrate_users([user.id], current_user)[user.id]
+    return render_template('user.html', user=profile, posts=hydrate_posts(posts.items, current_user),
                            title=user.username, form=form, next_url=next_url, prev_url=prev_url)
 
 
@@ -104,16 +110,14 @@ def edit_profile():
 def follow(username: str):
     form = EmptyForm()
     if form.validate_on_submit():
-        user = db.session.scalar(
-            sa.select(User).filter_by(username=username)
-        )
+        user = find_user(username)
         if user is None:
             flash(f'Пользователь {username} не найден')
             return redirect(url_for('main.index'))
-        if user == current_user:
+        if user.id == current_user.id:
             flash('Невозможно подписаться на самого себя')
             return redirect(url_for('main.user', username=username))
-        current_user.follow(user)
+        current_user.follow(user.attach())
         db.session.commit()
         flash(f'Вы успешно подписались на {username}')
         return redirect(url_for('main.user', username=username))
@@ -126,16 +130,14 @@ def follow(username: str):
 def unfollow(username: str):
     form = EmptyForm()
     if form.validate_on_submit():
-        user = db.session.scalar(
-            sa.select(User).filter_by(username=username)
-        )
+        user = find_user(username)
         if user is None:
             flash(f'Пользователь {username} не найден')
             return redirect(url_for('main.index'))
-        if user == current_user:
+        if user.id == current_user.id:
             flash('Невозможно отписаться от самого себя')
             return redirect(url_for('main.user', username=username))
-        current_user.unfollow(user)
+        current_user.unfollow(user.attach())
         db.session.commit()
         flash(f'Вы успешно отписались от {username}')
         return redirect(url_for('main.user', username=username))
@@ -146,8 +148,21 @@ def unfollow(username: str):
 @bp.route('/translate', methods=['POST'])
 @login_required
 def translate_text():
-    data = request.get_json()
-    return {'text': translate(data['text'], data['source_language'], data['dest_language'])}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    languages = data.get('source_language'), data.get('dest_language')
+    if not all(isinstance(language, str) and 0 < len(language) <= 5 for language in languages):
+        abort(400)
+    if 'texts' in data:
+        texts = data['texts']
+        if (not isinstance(texts, list) or len(texts) > app.config['TRANSLATOR_BATCH_SIZE']
+                or not all(isinstance(text, str) for text in texts)):
+            abort(400)
+        return {'texts': translate_many(texts, *languages)}
+    if not isinstance(data.get('text'), str):
+        abort(400)
+    return {'text': translate(data['text'], *languages)}
 
 
 @bp.route('/search')
@@ -156,29 +171,44 @@ def search():
     if not g.search_form.validate():
         return redirect(url_for('main.explore'))
     page = request.args.get('page', 1, type=int)
-    posts, total = Post.search(g.search_form.q.data, page, app.config['POSTS_PER_PAGE'])
+    posts, total = Post.search(g.search_form.q.data, page, app.config['POSTS_PER_PAGE'], so.joinedload(Post.author))
     next_url = url_for('main.search', q=g.search_form.q.data, page=page + 1) if total > page * app.config[
         'POSTS_PER_PAGE'] else None
     prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) if page > 1 else None
+    posts = hydrate_posts(posts, current_user, users={post.author for post in posts})
     return render_template('search.html', title='Поиск', posts=posts, next_url=next_url, prev_url=prev_url)
 
 
+@bp.route('/users/autocomplete')
+@login_required
+def autocomplete_users():
+    prefix = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 10, type=int), app.config['USERNAME_AUTOCOMPLETE_LIMIT'])
+    if not prefix or limit < 1:
+        return {'users': []}
+    return {'users': [{'id': id, 'username': username, 'follower_count': followers}
+                      for id, username, followers in complete_usernames(prefix, limit)]}
+
+
 @bp.route("/user/<username>/popup")
 @login_required
 def user_popup(username: str):
-    user = db.first_or_404(sa.select(User).filter_by(username=username))
+    user = find_user(username) or abort(404)
     form = EmptyForm()
-    return render_template('user_popup.html', user=user, form=form)
+    return render_template('user_popup.html', user=hydrate_users([user.id], current_user)[user.id], form=form)
 
 
 @bp.route('/send_message/<recipient>', methods=('GET', 'POST'))
 @login_required
 def send_message(recipient):
-    user = db.first_or_404(sa.select(User).filter_by(username=recipient))
+    user = find_user(recipient) or abort(404)
     form = MessageForm()
     if form.validate_on_submit():
-        msg = Message(author=current_user, recipient=user, body=form.message.data)
+        user = user.attach()
+        msg = Message(author=current_user, recipient=user, body=form.message.data,
+                      conversation_id=Conversation.between(current_user.id, user.id))
         db.session.add(msg)
+        db.session.flush()
         user.add_notification('unread_message_count', user.unread_message_count())
         db.session.commit()
         flash('Сообщение отправлено')
@@ -189,15 +219,31 @@ def send_message(recipient):
 @bp.route('/messages')
 @login_required
 def messages():
-    current_user.last_message_read_time = datetime.now(timezone.utc)
-    current_user.add_notification('unread_message_count', 0)
+    query = sa.select(ConversationMember).where(ConversationMember.user_id == current_user.id,
+                                                ConversationMember.last_message_at.is_not(None))
+    conversations, next_url, prev_url = paginate(query, 'main.messages', keys=('last_message_at', 'conversation_id'),
+                                                 keyset=True)
+    return render_template('messages.html', title='Сообщения',
+                           conversations=hydrate_conversations(conversations.items, current_user),
+                           next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/messages/<username>')
+@login_required
+def conversation(username):
+    user = find_user(username) or abort(404)
+    member = ConversationMember.find(current_user.id, user.id)
+    if member is None:
+        return redirect(url_for('main.send_message', recipient=username))
+    current_user.read_conversation(member)
+    current_user.add_notification('unread_message_count', current_user.unread_message_count())
     db.session.commit()
-    page = request.args.get('page', 1, type=int)
-    query = current_user.messages_received.select().order_by(Message.timestamp.desc())
-    messages = db.paginate(query, page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('main.messages', page=messages.next_num) if messages.has_next else None
-    prev_url = url_for('main.messages', page=messages.prev_num) if messages.has_prev else None
-    return render_template('messages.html', messages=messages.items, next_url=next_url, prev_url=prev_url)
+    query = sa.select(Message).where(Message.conversation_id == member.conversation_id).order_by(
+        Message.timestamp.desc(), Message.id.desc())
+    messages, next_url, prev_url = paginate(query, 'main.conversation', keyset=True, username=username)
+    return render_template('conversation.html', title=f'Переписка с {user.username}', user=user,
+                           messages=hydrate_posts(messages.items, current_user, 'sender_id'),
+                           next_url=next_url, prev_url=prev_url)
 
 
 @bp.route('/notifications')
@@ -206,12 +252,36 @@ def notifications():
     since = request.args.get('since', 0.0, type=float)
     query = current_user.notifications.select().where(Notification.timestamp > since).order_by(
         Notification.timestamp.asc())
-    notifications = db.session.scalars(query)
-    return [{
-        'name': notification.name,
-        'data': notification.get_data(),
-        'timestamp': notification.timestamp
-    } for notification in notifications]
+    return [notification.to_dict() for notification in db.session.scalars(query)]
+
+
+@bp.route('/notifications/stream')
+@login_required
+def notification_stream():
+    since = request.headers.get('Last-Event-ID', request.args.get('since', 0.0), type=float)
+    subscription = notification_bus().subscribe(current_user.id)
+    query = current_user.notifications.select().where(Notification.timestamp > since).order_by(
+        Notification.timestamp.asc())
+    backlog = [notification.to_dict() for notification in db.session.scalars(query)]
+    db.session.remove()
+    keepalive = app.config['NOTIFICATION_STREAM_KEEPALIVE']
+    deadline = monotonic() + app.config['NOTIFICATION_STREAM_TIMEOUT']
+
+    def events():
+        try:
+            for notification in backlog:
+                yield f'id: {notification["timestamp"]}\ndata: {json.dumps(notification)}\n\n'
+            while (remaining := deadline - monotonic()) > 0:
+                notification = subscription.get(min(keepalive, remaining))
+                if notification is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'id: {notification["timestamp"]}\ndata: {json.dumps(notification)}\n\n'
+        finally:
+            subscription.close()
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache',
+                                                                       'X-Accel-Buffering': 'no'})
 
 
 @bp.get("/export_posts")
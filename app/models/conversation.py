@@ -0,0 +1,101 @@
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from app import db
+from app.models import intpk
+from app.models.message import Message
+
+
+class Conversation(db.Model):
+    id: so.Mapped[intpk]
+    user1_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'))
+    user2_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'))
+
+    __table_args__ = (
+        sa.Index('ix_conversation_user1_id_user2_id', 'user1_id', 'user2_id', unique=True),
+    )
+
+    @classmethod
+    def ensure(cls, connection, user_id, other_id):
+        user1_id, user2_id = sorted((user_id, other_id))
+        query = sa.select(cls.id).where(cls.user1_id == user1_id, cls.user2_id == user2_id)
+        conversation_id = connection.scalar(query)
+        if conversation_id is None:
+            conversation_id = connection.scalar(
+                sa.insert(cls).values(user1_id=user1_id, user2_id=user2_id).returning(cls.id))
+            connection.execute(sa.insert(ConversationMember), [
+                {'conversation_id': conversation_id, 'user_id': member, 'peer_id': peer}
+                for member, peer in {(user1_id, user2_id), (user2_id, user1_id)}
+            ])
+        return conversation_id
+
+    @classmethod
+    def between(cls, user_id, other_id):
+        return cls.ensure(db.session.connection(), user_id, other_id)
+
+    @staticmethod
+    def record_messages(connection, messages):
+        latest, members, unread = {}, {}, Counter()
+        for conversation_id, sender_id, recipient_id, message_id, timestamp in messages:
+            if conversation_id not in latest or (timestamp, message_id) > latest[conversation_id]:
+                latest[conversation_id] = (timestamp, message_id)
+            members.setdefault(conversation_id, set()).update((sender_id, recipient_id))
+            if sender_id != recipient_id:
+                unread[conversation_id, recipient_id] += 1
+        if not latest:
+            return
+        table = ConversationMember.__table__
+        query = (sa.update(table)
+                 .where(table.c.conversation_id == sa.bindparam('id'), table.c.user_id == sa.bindparam('member_id'))
+                 .values(last_message_id=sa.bindparam('message_id'),
+                         last_message_at=sa.bindparam('timestamp'),
+                         unread_count=table.c.unread_count + sa.bindparam('unread')))
+        connection.execute(query, [
+            {'id': conversation_id, 'member_id': member_id, 'message_id': message_id, 'timestamp': timestamp,
+             'unread': unread[conversation_id, member_id]}
+            for conversation_id, (timestamp, message_id) in latest.items()
+            for member_id in members[conversation_id]
+        ])
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        messages = [obj for obj in session.new if isinstance(obj, Message)]
+        if not messages:
+            return
+        connection = session.connection()
+        for message in messages:
+            if message.conversation_id is None:
+                conversation_id = cls.ensure(connection, message.sender_id, message.recipient_id)
+                connection.execute(sa.update(Message.__table__).where(Message.__table__.c.id == message.id)
+                                   .values(conversation_id=conversation_id))
+                so.attributes.set_committed_value(message, 'conversation_id', conversation_id)
+        cls.record_messages(connection, [
+            (message.conversation_id, message.sender_id, message.recipient_id, message.id, message.timestamp)
+            for message in messages
+        ])
+
+
+class ConversationMember(db.Model):
+    conversation_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('conversation.id'), primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), primary_key=True)
+    peer_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'))
+    last_message_id: so.Mapped[Optional[int]]
+    last_message_at: so.Mapped[Optional[datetime]]
+    last_read_at: so.Mapped[Optional[datetime]]
+    unread_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+
+    __table_args__ = (
+        sa.Index('ix_conversation_member_user_id_peer_id', 'user_id', 'peer_id', unique=True),
+        sa.Index('ix_conversation_member_user_id_last_message_at', 'user_id', 'last_message_at', 'conversation_id'),
+    )
+
+    @classmethod
+    def find(cls, user_id, peer_id):
+        return db.session.scalar(sa.select(cls).filter_by(user_id=user_id, peer_id=peer_id))
+
+
+db.event.listen(db.session, 'after_flush', Conversation.after_flush)
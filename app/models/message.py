@@ -1,3 +1,5 @@
+from typing import Optional
+
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 
@@ -9,6 +11,7 @@ class Message(db.Model):
     id: so.Mapped[intpk]
     sender_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), index=True)
     recipient_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), index=True)
+    conversation_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey('conversation.id'))
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
     timestamp: so.Mapped[timestamp]
 
@@ -22,5 +25,9 @@ class Message(db.Model):
         back_populates='messages_received'
     )
 
+    __table_args__ = (
+        sa.Index('ix_message_conversation_id_timestamp', 'conversation_id', 'timestamp', 'id'),
+    )
+
     def __repr__(self):
         return f'<Message {self.body}>'
@@ -1,19 +1,37 @@
-from app.search import add_to_index, remove_from_index, query_index
+import re
+
+from app.search import bump_generation, cached_query, document, register, search_backend
 import sqlalchemy as sa
+import sqlalchemy.orm as so
 from app import db
-from flask import url_for
+from app.pagination import CountedPagination, KeysetPagination
+from flask import current_app, has_request_context, request, url_for
+
+
+def url_template(endpoint, field):
+    rule = next(current_app.url_map.iter_rules(endpoint))
+    path = rule.rule.replace('{', '{{').replace('}', '}}')
+    path = re.sub(rf'<(?:[^<>]*:)?{re.escape(field)}>', '{id}', path)
+    if '<' in path:
+        raise ValueError(f'{endpoint} has URL arguments other than {field}')
+    root = request.script_root if has_request_context() else current_app.config['APPLICATION_ROOT'].rstrip('/')
+    return root + path
 
 
 class PaginatedAPIMixin(object):
-    @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
-        resources = db.paginate(query, page=page, per_page=per_page, error_out=False)
+    @classmethod
+    def to_dict_many(cls, items):
+        return [item.to_dict() for item in items]
+
+    @classmethod
+    def to_collection_dict(cls, query, page, per_page, endpoint, count='exact', count_key=None, **kwargs):
+        resources = CountedPagination(query, page, per_page, count, count_key)
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': cls.to_dict_many(resources.items),
             '_meta': {
                 'page': page,
                 'per_page': per_page,
-                'total_pages': resources.pages,
+                'total_pages': resources.pages if resources.total is not None else None,
                 'total_items': resources.total,
             },
             '_links': {
@@ -24,45 +42,80 @@ class PaginatedAPIMixin(object):
         }
         return data
 
+    @classmethod
+    def to_cursor_collection_dict(cls, query, keys, per_page, endpoint, after=None, before=None, include_total=False,
+                                  **kwargs):
+        resources = KeysetPagination(query, per_page, after, before, keys, descending=False, count=include_total)
+        data = {
+            'items': cls.to_dict_many(resources.items),
+            '_meta': {
+                'per_page': per_page,
+            },
+            '_links': {
+                'self': url_for(endpoint, after=after, before=before, per_page=per_page, **kwargs),
+                'next': url_for(endpoint, after=resources.next_cursor, per_page=per_page,
+                                **kwargs) if resources.next_cursor else None,
+                'prev': url_for(endpoint, before=resources.prev_cursor, per_page=per_page,
+                                **kwargs) if resources.prev_cursor else None
+            }
+        }
+        if include_total:
+            data['_meta']['total_items'] = resources.total
+        return data
+
 
 class SearchableMixin(object):
     @classmethod
-    def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            return [], 0
-        when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        query = sa.select(cls).where(cls.id.in_(ids)).order_by(db.case(*when, value=cls.id))
-        return db.session.scalars(query), total
+    def search(cls, expression, page, per_page, *options):
+        ids, total = cached_query(cls.__tablename__, expression, page, per_page)
+        if not ids:
+            return [], total
+        query = sa.select(cls).where(cls.id.in_(ids)).options(*options)
+        objects = {obj.id: obj for obj in db.session.scalars(query)}
+        return [objects[id] for id in ids if id in objects], total
 
     @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+    def after_flush(cls, session, flush_context):
+        backend = search_backend()
+        if backend is None:
+            return
+        operations = [('index', obj.__tablename__, obj.id, document(obj))
+                      for obj in session.new if isinstance(obj, SearchableMixin)]
+        operations += [('index', obj.__tablename__, obj.id, document(obj))
+                       for obj in session.dirty if isinstance(obj, SearchableMixin) and obj.search_changed()]
+        operations += [('delete', obj.__tablename__, obj.id, None)
+                       for obj in session.deleted if isinstance(obj, SearchableMixin)]
+        if operations:
+            backend.record(session.connection(), operations)
+            session.info.setdefault('search_indices', set()).update(index for _, index, _, _ in operations)
 
     @classmethod
     def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['delete']:
-            if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
-        session._changes = None
+        for index in session.info.pop('search_indices', ()):
+            bump_generation(index)
 
     @classmethod
-    def reindex(cls):
-        for obj in db.session.scalars(sa.select(cls)):
-            add_to_index(cls.__tablename__, obj)
+    def after_rollback(cls, session):
+        session.info.pop('search_indices', None)
+
+    def search_changed(self):
+        return any(so.attributes.get_history(self, field).has_changes() for field in self.__searchable__)
+
+    @classmethod
+    def reindex(cls, processes=1):
+        backend = search_backend()
+        if backend is None:
+            return 0, []
+        result = backend.reindex(cls, processes)
+        bump_generation(cls.__tablename__)
+        return result
+
+
+@sa.event.listens_for(SearchableMixin, 'instrument_class', propagate=True)
+def register_search_index(mapper, cls):
+    register(mapper.local_table, cls.__searchable__)
 
 
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
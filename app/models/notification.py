@@ -2,6 +2,7 @@ from time import time
 import json
 import sqlalchemy as sa
 import sqlalchemy.orm as so
+from sqlalchemy.dialects import postgresql, sqlite
 
 from app import db
 from app.models import intpk
@@ -10,11 +11,60 @@ from app.models import intpk
 class Notification(db.Model):
     id: so.Mapped[intpk]
     name: so.Mapped[str] = so.mapped_column(sa.String(128), index=True)
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), index=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'))
     timestamp: so.Mapped[float] = so.mapped_column(index=True, default=time)
     payload_json: so.Mapped[str] = so.mapped_column(sa.Text)
 
     user: so.Mapped['User'] = so.relationship(back_populates='notifications')
 
+    __table_args__ = (
+        sa.Index('ix_notification_user_id_name', 'user_id', 'name', unique=True),
+        sa.Index('ix_notification_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    @staticmethod
+    def _upsert_insert():
+        return {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(db.session.get_bind().dialect.name)
+
+    @classmethod
+    def upsert(cls, user_id, name, data):
+        values = {'user_id': user_id, 'name': name, 'payload_json': json.dumps(data), 'timestamp': time()}
+        insert = cls._upsert_insert()
+        if insert is None:
+            db.session.execute(sa.delete(cls).filter_by(user_id=user_id, name=name))
+            notification = cls(**values)
+            db.session.add(notification)
+            return notification
+        query = insert(cls).values(**values)
+        query = query.on_conflict_do_update(
+            index_elements=['user_id', 'name'],
+            set_={'payload_json': query.excluded.payload_json, 'timestamp': query.excluded.timestamp}
+        ).returning(cls)
+        return db.session.scalar(query, execution_options={'populate_existing': True})
+
+    @classmethod
+    def upsert_from_select(cls, name, query):
+        columns = ['user_id', 'payload_json', 'name', 'timestamp']
+        source = query.add_columns(sa.literal(name), sa.literal(time()))
+        insert = cls._upsert_insert()
+        if insert is None:
+            users = sa.select(source.subquery().c[0])
+            db.session.execute(sa.delete(cls).where(cls.name == name, cls.user_id.in_(users)))
+            db.session.execute(sa.insert(cls).from_select(columns, source))
+            return db.session.scalars(sa.select(cls).where(cls.name == name, cls.user_id.in_(users))).all()
+        insert = insert(cls).from_select(columns, source)
+        insert = insert.on_conflict_do_update(
+            index_elements=['user_id', 'name'],
+            set_={'payload_json': insert.excluded.payload_json, 'timestamp': insert.excluded.timestamp}
+        ).returning(cls)
+        return db.session.scalars(insert, execution_options={'populate_existing': True}).all()
+
     def get_data(self):
         return json.loads(str(self.payload_json))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'data': self.get_data(),
+            'timestamp': self.timestamp
+        }
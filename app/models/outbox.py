@@ -0,0 +1,16 @@
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from app import db
+from app.models import intpk
+
+
+class SearchOutbox(db.Model):
+    id: so.Mapped[intpk]
+    action: so.Mapped[str] = so.mapped_column(sa.String(16))
+    index: so.Mapped[str] = so.mapped_column(sa.String(64))
+    document_id: so.Mapped[int]
+    attempts: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    available_at: so.Mapped[datetime] = so.mapped_column(index=True, default=lambda: datetime.now(timezone.utc))
@@ -15,5 +15,9 @@ class Post(db.Model, SearchableMixin):
     author: so.Mapped['User'] = so.relationship(back_populates='posts')
     language: so.Mapped[Optional[str]] = so.mapped_column(sa.String(5))
 
+    __table_args__ = (
+        sa.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<Post {self.body}>'
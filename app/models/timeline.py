@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app as app
+
+from app import db
+from app.models.post import Post
+
+followers = sa.table('followers', sa.column('follower_id'), sa.column('followed_id'))
+users = sa.table('user', sa.column('id'), sa.column('follower_counter'))
+
+
+class TimelineEntry(db.Model):
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id', ondelete='cascade'), primary_key=True)
+    post_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('post.id', ondelete='cascade'), primary_key=True)
+    author_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id', ondelete='cascade'))
+    timestamp: so.Mapped[datetime]
+
+    __table_args__ = (
+        sa.Index('ix_timeline_entry_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    @staticmethod
+    def enabled():
+        return app.config['HOME_TIMELINE']
+
+    @staticmethod
+    def fanout_limit():
+        return app.config['TIMELINE_FANOUT_LIMIT']
+
+    @classmethod
+    def is_celebrity(cls, connection, author_id):
+        query = sa.select(users.c.follower_counter).where(users.c.id == author_id)
+        return (connection.scalar(query) or 0) > cls.fanout_limit()
+
+    @classmethod
+    def celebrities(cls, follower_id):
+        query = (sa.select(followers.c.followed_id)
+                 .join(users, users.c.id == followers.c.followed_id)
+                 .where(followers.c.follower_id == follower_id, users.c.follower_counter > cls.fanout_limit()))
+        return db.session.scalars(query).all()
+
+    @classmethod
+    def fan_out(cls, connection, post):
+        rows = [sa.select(sa.literal(post.user_id), sa.literal(post.id), sa.literal(post.user_id),
+                          sa.literal(post.timestamp))]
+        if not cls.is_celebrity(connection, post.user_id):
+            rows.append(sa.select(followers.c.follower_id, sa.literal(post.id), sa.literal(post.user_id),
+                                  sa.literal(post.timestamp))
+                        .where(followers.c.followed_id == post.user_id))
+        columns = ['user_id', 'post_id', 'author_id', 'timestamp']
+        connection.execute(sa.insert(cls).from_select(columns, sa.union_all(*rows)))
+
+    @classmethod
+    def backfill(cls, user, author):
+        if not cls.enabled() or cls.is_celebrity(db.session.connection(), author.id):
+            return
+        query = sa.select(sa.literal(user.id), Post.id, Post.user_id, Post.timestamp).where(Post.user_id == author.id)
+        db.session.execute(sa.insert(cls).from_select(['user_id', 'post_id', 'author_id', 'timestamp'], query))
+
+    @classmethod
+    def trim(cls, user, author):
+        if not cls.enabled():
+            return
+        db.session.execute(sa.delete(cls).where(cls.user_id == user.id, cls.author_id == author.id))
+        query = sa.select(users.c.follower_counter).where(users.c.id == author.id)
+        if db.session.scalar(query) == cls.fanout_limit():
+            cls.materialize(author)
+
+    @classmethod
+    def materialize(cls, author):
+        exists = sa.exists().where(cls.user_id == followers.c.follower_id, cls.post_id == Post.id)
+        query = (sa.select(followers.c.follower_id, Post.id, Post.user_id, Post.timestamp)
+                 .join(followers, followers.c.followed_id == Post.user_id)
+                 .where(Post.user_id == author.id, ~exists))
+        db.session.execute(sa.insert(cls).from_select(['user_id', 'post_id', 'author_id', 'timestamp'], query))
+
+    @classmethod
+    def rebuild(cls):
+        celebrities = sa.select(users.c.id).where(users.c.follower_counter > cls.fanout_limit())
+        columns = ['user_id', 'post_id', 'author_id', 'timestamp']
+        db.session.execute(sa.delete(cls))
+        db.session.execute(sa.insert(cls).from_select(
+            columns, sa.select(Post.user_id, Post.id, Post.user_id, Post.timestamp)))
+        db.session.execute(sa.insert(cls).from_select(
+            columns,
+            sa.select(followers.c.follower_id, Post.id, Post.user_id, Post.timestamp)
+            .join(followers, followers.c.followed_id == Post.user_id)
+            .where(Post.user_id.not_in(celebrities))
+        ))
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        if not cls.enabled():
+            return
+        connection = session.connection()
+        for obj in session.new:
+            if isinstance(obj, Post):
+                cls.fan_out(connection, obj)
+        deleted = [obj.id for obj in session.deleted if isinstance(obj, Post)]
+        if deleted:
+            connection.execute(sa.delete(cls).where(cls.post_id.in_(deleted)))
+
+
+db.event.listen(db.session, 'after_flush', TimelineEntry.after_flush)
@@ -0,0 +1,13 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from app import db
+from app.models import timestamp
+
+
+class Translation(db.Model):
+    text_hash: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    source_language: so.Mapped[str] = so.mapped_column(sa.String(5), primary_key=True)
+    dest_language: so.Mapped[str] = so.mapped_column(sa.String(5), primary_key=True)
+    text: so.Mapped[str] = so.mapped_column(sa.Text)
+    timestamp: so.Mapped[timestamp]
@@ -1,5 +1,5 @@
-import json
 import secrets
+from collections import Counter
 from datetime import datetime, timezone, timedelta
 from hashlib import md5
 from time import time
@@ -9,17 +9,21 @@ import jwt
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 from celery import shared_task
-from flask import current_app as app, url_for
+from flask import current_app as app
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 
-from app import db, login
+from app import db
+from app.events import publish_after_commit
 from app.models import timestamp
+from app.models.conversation import ConversationMember
 from app.models.message import Message
 from app.models.notification import Notification
 from app.models.post import Post
 from app.models.task import Task
-from app.models.mixins import PaginatedAPIMixin
+from app.models.timeline import TimelineEntry
+from app.models.mixins import PaginatedAPIMixin, url_template
+from app.passwords import passwords
+from app.tokens import issue_token, verify_token
 
 followers = sa.Table(
     'followers',
@@ -28,6 +32,8 @@ followers = sa.Table(
     sa.Column('followed_id', sa.Integer, sa.ForeignKey('user.id'), primary_key=True)
 )
 
+FOLLOWING_POSTS_STRATEGIES = ('join', 'union', 'exists', 'topn')
+
 
 class User(PaginatedAPIMixin, UserMixin, db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -36,6 +42,10 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     password_hash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(256))
     about_me: so.Mapped[Optional[str]] = so.mapped_column(sa.String(140))
     last_seen: so.Mapped[timestamp]
+    post_counter: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    follower_counter: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    following_counter: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    unread_message_counter: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
 
     posts: so.WriteOnlyMapped['Post'] = so.relationship(back_populates='author')
     membership: so.WriteOnlyMapped['Membership'] = so.relationship(back_populates='user')
@@ -65,6 +75,8 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     token_expiration: so.Mapped[datetime | None]
 
     def get_token(self, expires_in=3600):
+        if app.config['API_TOKEN_FORMAT'] == 'signed':
+            return issue_token(self.id, expires_in)
         now = datetime.now(timezone.utc)
         if self.token and self.token_expiration.replace(tzinfo=timezone.utc) > now + timedelta(seconds=60):
             return self.token
@@ -78,16 +90,23 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 
     @staticmethod
     def check_token(token):
+        if app.config['API_TOKEN_FORMAT'] == 'signed':
+            return verify_token(token)
         user = db.session.scalar(sa.select(User).filter_by(token=token))
         if user is None or user.token_expiration.replace(tzinfo=timezone.utc) < datetime.now(timezone.utc):
             return None
         return user
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords().hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        hasher = passwords()
+        if not hasher.verify(self.password_hash, password):
+            return False
+        if hasher.needs_rehash(self.password_hash):
+            self.password_hash = hasher.hash(password)
+        return True
 
     def get_password_token(self, expires_in=600):
         return jwt.encode(
@@ -114,20 +133,34 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     def follow(self, user):
         if not self.is_following(user):
             self.following.add(user)
+            self._update_follow_counters(user, 1)
+            TimelineEntry.backfill(self, user)
 
     def unfollow(self, user):
         if self.is_following(user):
             self.following.remove(user)
+            self._update_follow_counters(user, -1)
+            TimelineEntry.trim(self, user)
+
+    def _update_follow_counters(self, user, delta):
+        db.session.execute(sa.update(User).where(User.id == self.id)
+                           .values(following_counter=User.following_counter + delta))
+        db.session.execute(sa.update(User).where(User.id == user.id)
+                           .values(follower_counter=User.follower_counter + delta))
 
     def followers_count(self):
-        query = sa.select(sa.func.count()).select_from(self.followers.select().subquery())
-        return db.session.scalar(query)
+        return self.follower_counter
 
     def following_count(self):
-        query = sa.select(sa.func.count()).select_from(self.following.select().subquery())
-        return db.session.scalar(query)
+        return self.following_counter
+
+    def following_posts(self, limit=None, strategy=None):
+        strategy = strategy or app.config['FOLLOWING_POSTS_STRATEGY']
+        if strategy not in FOLLOWING_POSTS_STRATEGIES:
+            raise ValueError(f'Unknown following posts strategy: {strategy}')
+        return getattr(self, f'_following_posts_{strategy}')(limit)
 
-    def following_posts(self):
+    def _following_posts_join(self, limit):
         author_alias = so.aliased(User)
         follower_alias = so.aliased(User)
         query = (sa.select(Post)
@@ -135,18 +168,80 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
                  .join(author_alias.followers.of_type(follower_alias), isouter=True)
                  .where(sa.or_(follower_alias.id == self.id, author_alias.id == self.id))
                  .group_by(Post)
-                 .order_by(Post.timestamp.desc()))
+                 .order_by(Post.timestamp.desc(), Post.id.desc()))
         return query
 
+    def _following_posts_union(self, limit):
+        posts = sa.union_all(
+            sa.select(Post).where(Post.user_id == self.id),
+            sa.select(Post)
+            .join(followers, followers.c.followed_id == Post.user_id)
+            .where(followers.c.follower_id == self.id)
+        ).subquery()
+        post = so.aliased(Post, posts)
+        return sa.select(post).order_by(post.timestamp.desc(), post.id.desc())
+
+    def _following_posts_exists(self, limit):
+        followed = sa.exists().where(followers.c.follower_id == self.id, followers.c.followed_id == Post.user_id)
+        return (sa.select(Post)
+                .where(sa.or_(Post.user_id == self.id, followed))
+                .order_by(Post.timestamp.desc(), Post.id.desc()))
+
+    def _following_posts_topn(self, limit):
+        authors = sa.union_all(
+            sa.select(sa.literal(self.id).label('author_id')),
+            sa.select(followers.c.followed_id).where(followers.c.follower_id == self.id)
+        ).subquery()
+        latest = (sa.select(Post.id)
+                  .where(Post.user_id == authors.c.author_id)
+                  .order_by(Post.timestamp.desc(), Post.id.desc())
+                  .correlate(authors))
+        query = (sa.select(Post)
+                 .select_from(authors)
+                 .join(Post, Post.id.in_(latest.limit(limit) if limit else latest))
+                 .order_by(Post.timestamp.desc(), Post.id.desc()))
+        return query.limit(limit) if limit else query
+
+    def home_timeline(self, limit=None):
+        if not TimelineEntry.enabled():
+            return self.following_posts(limit)
+        entries = sa.select(TimelineEntry.post_id).where(TimelineEntry.user_id == self.id)
+        celebrities = TimelineEntry.celebrities(self.id)
+        if celebrities:
+            return (sa.select(Post)
+                    .where(sa.or_(Post.id.in_(entries), Post.user_id.in_(celebrities)))
+                    .order_by(Post.timestamp.desc(), Post.id.desc()))
+        return (sa.select(Post)
+                .join(TimelineEntry, TimelineEntry.post_id == Post.id)
+                .where(TimelineEntry.user_id == self.id)
+                .order_by(TimelineEntry.timestamp.desc(), TimelineEntry.post_id.desc()))
+
     def unread_message_count(self):
-        last_read_time = self.last_message_read_time or datetime(1900, 1, 1)
-        query = sa.select(Message).where(Message.recipient == self, Message.timestamp > last_read_time)
-        return db.session.scalar(sa.select(sa.func.count()).select_from(query.subquery()))
+        return self.unread_message_counter
+
+    def read_messages(self):
+        self.last_message_read_time = datetime.now(timezone.utc)
+        self.unread_message_counter = 0
+        db.session.execute(sa.update(ConversationMember).where(
+            ConversationMember.user_id == self.id, ConversationMember.unread_count > 0
+        ).values(unread_count=0, last_read_at=self.last_message_read_time))
+
+    def read_conversation(self, member):
+        if not member.unread_count:
+            return
+        db.session.execute(sa.update(User).where(User.id == self.id).values(
+            unread_message_counter=sa.case(
+                (User.unread_message_counter > member.unread_count,
+                 User.unread_message_counter - member.unread_count),
+                else_=0)
+        ).execution_options(synchronize_session=False))
+        db.session.expire(self, ['unread_message_counter'])
+        member.unread_count = 0
+        member.last_read_at = datetime.now(timezone.utc)
 
     def add_notification(self, name, data):
-        db.session.execute(self.notifications.delete().filter_by(name=name))
-        notification = Notification(name=name, payload_json=json.dumps(data), user=self)
-        db.session.add(notification)
+        notification = Notification.upsert(self.id, name, data)
+        publish_after_commit(self.id, notification.to_dict())
         return notification
 
     def launch_task(self, task: shared_task, description, *args, **kwargs):
@@ -166,10 +261,74 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return db.session.scalar(query)
 
     def posts_count(self):
-        query = sa.select(sa.func.count()).select_from(self.posts.select().subquery())
-        return db.session.scalar(query)
+        return self.post_counter
+
+    @staticmethod
+    def reconcile_counters():
+        def count(column):
+            return (sa.select(sa.func.count()).select_from(column.table)
+                    .where(column == User.id).scalar_subquery())
+
+        unread = (sa.select(sa.func.coalesce(sa.func.sum(ConversationMember.unread_count), 0))
+                  .where(ConversationMember.user_id == User.id)
+                  .scalar_subquery())
+        db.session.execute(sa.update(User).values(
+            post_counter=count(Post.user_id),
+            follower_counter=count(followers.c.followed_id),
+            following_counter=count(followers.c.follower_id),
+            unread_message_counter=unread,
+        ).execution_options(synchronize_session=False))
+
+    @staticmethod
+    def update_post_counters(session, flush_context, instances):
+        def author(post):
+            if post.author is None and post.user_id is not None:
+                return session.get(User, post.user_id)
+            return post.author
+
+        deltas = Counter()
+        for obj in session.new:
+            if isinstance(obj, Post):
+                deltas[author(obj)] += 1
+        for obj in session.deleted:
+            if isinstance(obj, Post):
+                deltas[author(obj)] -= 1
+        for author, delta in deltas.items():
+            if author is None or not delta:
+                continue
+            if sa.inspect(author).pending:
+                author.post_counter = (author.post_counter or 0) + delta
+            else:
+                author.post_counter = User.post_counter + delta
+
+    @staticmethod
+    def update_message_counters(session, flush_context):
+        deltas = Counter(obj.recipient_id for obj in session.new if isinstance(obj, Message))
+        table = User.__table__
+        for recipient_id, delta in deltas.items():
+            query = (sa.update(table).where(table.c.id == recipient_id)
+                     .values(unread_message_counter=table.c.unread_message_counter + delta)
+                     .returning(table.c.unread_message_counter))
+            count = session.connection().scalar(query)
+            recipient = session.identity_map.get(session.identity_key(User, recipient_id))
+            if recipient is not None:
+                so.attributes.set_committed_value(recipient, 'unread_message_counter', count)
+
+    @staticmethod
+    def link_templates():
+        return {
+            'self': url_template('api.get_user', 'user_id'),
+            'followers': url_template('api.get_followers', 'user_id'),
+            'following': url_template('api.get_following', 'user_id'),
+        }
+
+    @classmethod
+    def to_dict_many(cls, items):
+        links = cls.link_templates()
+        return [item.to_dict(links=links) for item in items]
 
-    def to_dict(self, include_email=False):
+    def to_dict(self, include_email=False, links=None):
+        links = links or User.link_templates()
         data = {
             'id': self.id,
             'username': self.username,
@@ -179,9 +338,9 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             'follower_count': self.followers_count(),
             'following_count': self.following_count(),
             '_links': {
-                'self': url_for('api.get_user', user_id=self.id),
-                'followers': url_for('api.get_followers', user_id=self.id),
-                'following': url_for('api.get_following', user_id=self.id),
+                'self': links['self'].format(id=self.id),
+                'followers': links['followers'].format(id=self.id),
+                'following': links['following'].format(id=self.id),
                 'avatar': self.avatar(128)
             }
         }
@@ -200,6 +359,5 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return f'<User {self.username}>'
 
 
-@login.user_loader
-def load_user(user_id):
-    return db.session.get(User, int(user_id))
+db.event.listen(db.session, 'before_flush', User.update_post_counters)
+db.event.listen(db.session, 'after_flush', User.update_message_counters)
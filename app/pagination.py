@@ -0,0 +1,181 @@
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.exc import DBAPIError
+from flask import current_app as app, request, url_for
+from flask_sqlalchemy.pagination import SelectPagination
+
+from app import db
+from app.cache import get_cache
+
+COUNT_STRATEGIES = ('exact', 'cached', 'estimate', 'none')
+
+
+def encode_cursor(values):
+    data = [['d', value.isoformat()] if isinstance(value, datetime) else ['v', value] for value in values]
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return [datetime.fromisoformat(value) if kind == 'd' else value for kind, value in data]
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+
+def _cursor_matches(columns, values):
+    if values is None or len(values) != len(columns):
+        return False
+    for column, value in zip(columns, values):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return False
+        if isinstance(value, bool) or not isinstance(value, python_type):
+            return False
+    return True
+
+
+def _keyset_condition(columns, values, descending):
+    column, value = columns[0], values[0]
+    condition = column < value if descending else column > value
+    if len(columns) == 1:
+        return condition
+    return sa.or_(condition, sa.and_(column == value, _keyset_condition(columns[1:], values[1:], descending)))
+
+
+class KeysetPagination:
+    def __init__(self, query, per_page, after=None, before=None, keys=('timestamp', 'id'), descending=True,
+                 count=False):
+        self.per_page = per_page
+        self.keys = [query.selected_columns[key] if isinstance(key, str) else key for key in keys]
+        after, before = decode_cursor(after), decode_cursor(before)
+        backwards = before is not None and after is None
+        cursor = before if backwards else after
+        reverse = descending != backwards
+        query = base = query.order_by(None)
+        if _cursor_matches(self.keys, cursor):
+            query = query.where(_keyset_condition(self.keys, cursor, reverse))
+        else:
+            cursor = None
+        order = [key.desc() if reverse else key.asc() for key in self.keys]
+        items = db.session.scalars(query.order_by(*order).limit(per_page + 1)).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            self.has_next, self.has_prev = True, more
+        else:
+            self.has_next, self.has_prev = more, cursor is not None
+        self.items = items
+        self.total = db.session.scalar(sa.select(sa.func.count()).select_from(base.subquery())) if count else None
+
+    def _cursor(self, item):
+        return encode_cursor([getattr(item, key.key) for key in self.keys])
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.items[-1]) if self.has_next and self.items else None
+
+    @property
+    def prev_cursor(self):
+        return self._cursor(self.items[0]) if self.has_prev and self.items else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def count_strategy(endpoint):
+    strategy = app.config['PAGINATION_COUNT_STRATEGIES'].get(endpoint, app.config['PAGINATION_COUNT_STRATEGY'])
+    if strategy not in COUNT_STRATEGIES:
+        raise ValueError(f'Unknown count strategy: {strategy}')
+    return strategy
+
+
+def estimate_count(query):
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    compiled = query.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    try:
+        with connection.begin_nested():
+            plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + compiled.string, params).scalar()
+    except DBAPIError as e:
+        app.logger.warning(f'Could not estimate row count: {e}')
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CountedPagination(SelectPagination):
+    def __init__(self, query, page, per_page, count='exact', count_key=None):
+        self.count = count
+        self.count_key = count_key
+        self.more = None
+        super().__init__(select=query, session=db.session(), page=page, per_page=per_page, max_per_page=None,
+                         error_out=False, count=count != 'none')
+
+    def _query_items(self):
+        if self.count == 'exact':
+            return super()._query_items()
+        query = self._query_args['select'].limit(self.per_page + 1).offset(self._query_offset)
+        items = list(self._query_args['session'].execute(query).unique().scalars())
+        self.more = len(items) > self.per_page
+        return items[:self.per_page]
+
+    def _query_count(self):
+        if self.count == 'cached':
+            cache = get_cache('counts', app.config['COUNT_CACHE_SIZE'], app.config['COUNT_CACHE_TTL'])
+            key = self.count_key or self._shape_key()
+            total = cache.get(key)
+            if total is None:
+                total = super()._query_count()
+                cache.set(key, total)
+        elif self.count == 'estimate':
+            total = estimate_count(self._query_args['select'].order_by(None))
+            if total is None:
+                total = super()._query_count()
+        else:
+            total = super()._query_count()
+        if self.more is not None:
+            total = max(total, self._query_offset + len(self.items) + int(self.more))
+        return total
+
+    def _shape_key(self):
+        compiled = self._query_args['select'].compile(dialect=self._query_args['session'].get_bind().dialect)
+        shape = compiled.string + repr(sorted(compiled.params.items()))
+        return hashlib.md5(shape.encode('utf-8')).hexdigest()
+
+    @property
+    def has_next(self):
+        if self.more is not None:
+            return self.more
+        return super().has_next
+
+
+def use_keyset():
+    return app.config['PAGINATION_MODE'] == 'keyset' or 'after' in request.args or 'before' in request.args
+
+
+def paginate(query, endpoint, keys=('timestamp', 'id'), keyset=False, **kwargs):
+    per_page = app.config['POSTS_PER_PAGE']
+    if keyset or use_keyset():
+        page = KeysetPagination(query, per_page, request.args.get('after'), request.args.get('before'), keys)
+        next_url = url_for(endpoint, after=page.next_cursor, **kwargs) if page.next_cursor else None
+        prev_url = url_for(endpoint, before=page.prev_cursor, **kwargs) if page.prev_cursor else None
+        return page, next_url, prev_url
+    page = CountedPagination(query, request.args.get('page', 1, type=int), per_page, count_strategy(endpoint))
+    next_url = url_for(endpoint, page=page.next_num, **kwargs) if page.has_next else None
+    prev_url = url_for(endpoint, page=page.prev_num, **kwargs) if page.has_prev else None
+    return page, next_url, prev_url
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app as app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from gevent.monkey import is_module_patched
+    from gevent.threadpool import ThreadPool
+except ImportError:
+    ThreadPool = None
+
+
+class PasswordHasher:
+    def __init__(self, workers):
+        if ThreadPool is not None and is_module_patched('threading'):
+            self.pool = ThreadPool(workers)
+            self.run = self.pool.apply
+        else:
+            self.pool = ThreadPoolExecutor(workers, thread_name_prefix='passwords')
+            self.run = lambda func, args: self.pool.submit(func, *args).result()
+
+    @property
+    def method(self):
+        return app.config['PASSWORD_HASH_METHOD']
+
+    def hash(self, password):
+        return self.run(generate_password_hash, (password, self.method))
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self.run(check_password_hash, (password_hash, password))
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != method_prefix(self.method)
+
+
+@lru_cache
+def method_prefix(method):
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def passwords():
+    if 'passwords' not in app.extensions:
+        app.extensions['passwords'] = PasswordHasher(app.config['PASSWORD_HASH_WORKERS'])
+    return app.extensions['passwords']
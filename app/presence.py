@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+from threading import Lock
+from time import time, monotonic
+
+import sqlalchemy as sa
+from flask import current_app as app
+from redis.exceptions import RedisError
+
+from app import db
+from app.models.user import User
+
+
+class LocalPresence:
+    def __init__(self):
+        self.pending = {}
+        self.lock = Lock()
+
+    def touch(self, user_id, seen):
+        with self.lock:
+            if self.pending.get(user_id) == seen:
+                return
+            self.pending[user_id] = seen
+
+    def get(self, ids):
+        with self.lock:
+            return {id: self.pending[id] for id in ids if id in self.pending}
+
+    def drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            return pending
+
+
+class RedisPresence:
+    key = 'presence:last_seen'
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.recent = {}
+
+    def touch(self, user_id, seen):
+        if self.recent.get(user_id) == seen:
+            return
+        self.redis.hset(self.key, user_id, seen)
+        self.recent[user_id] = seen
+
+    def get(self, ids):
+        values = self.redis.hmget(self.key, ids) if ids else []
+        return {id: float(value) for id, value in zip(ids, values) if value is not None}
+
+    def drain(self):
+        pipeline = self.redis.pipeline()
+        pipeline.hgetall(self.key)
+        pipeline.delete(self.key)
+        pending = pipeline.execute()[0]
+        self.recent.clear()
+        return {int(id): float(seen) for id, seen in pending.items()}
+
+
+class Presence:
+    def __init__(self, store, granularity, interval):
+        self.store = store
+        self.granularity = granularity
+        self.interval = interval
+        self.flushed_at = monotonic()
+
+    def touch(self, user_id):
+        now = time()
+        try:
+            self.store.touch(user_id, now - now % self.granularity)
+            if monotonic() - self.flushed_at > self.interval:
+                self.flush()
+        except RedisError as e:
+            app.logger.warning(f'Presence store is unavailable: {e}')
+
+    def last_seen(self, ids):
+        try:
+            pending = self.store.get(list(ids))
+        except RedisError:
+            return {}
+        return {id: datetime.fromtimestamp(seen, timezone.utc) for id, seen in pending.items()}
+
+    def flush(self):
+        self.flushed_at = monotonic()
+        pending = self.store.drain()
+        if not pending:
+            return 0
+        table = User.__table__
+        query = (sa.update(table)
+                 .where(table.c.id == sa.bindparam('user_id'))
+                 .values(last_seen=sa.bindparam('seen')))
+        with db.engine.begin() as connection:
+            connection.execute(query, [{'user_id': id, 'seen': datetime.fromtimestamp(seen, timezone.utc)}
+                                       for id, seen in pending.items()])
+        return len(pending)
+
+
+def presence():
+    if 'presence' not in app.extensions:
+        store = RedisPresence(app.redis) if app.redis else LocalPresence()
+        app.extensions['presence'] = Presence(store, app.config['PRESENCE_GRANULARITY'],
+                                              app.config['PRESENCE_FLUSH_INTERVAL'])
+    return app.extensions['presence']
+
+
+def fresher(stored, pending):
+    if stored is not None and stored.tzinfo is None:
+        stored = stored.replace(tzinfo=timezone.utc)
+    if pending is None or stored is None:
+        return pending or stored
+    return max(stored, pending)
@@ -1,30 +1,388 @@
+import multiprocessing
+import re
+from hashlib import md5
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from time import monotonic
+
+import sqlalchemy as sa
+from elasticsearch import ApiError, Elasticsearch, TransportError
 from flask import current_app as app
 
+from app import db
+from app.cache import get_cache
+from app.models.outbox import SearchOutbox
+
+TEXT_SEARCH_CONFIG = 'simple'
+
+
+def document(model):
+    return {field: getattr(model, field) for field in model.__searchable__}
+
+
+def searchable_models():
+    return {mapper.class_.__tablename__: mapper.class_ for mapper in db.Model.registry.mappers
+            if hasattr(mapper.class_, '__searchable__')}
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query)
+
+
+def fts_table(index):
+    return f'{index}_fts'
+
+
+def search_vector(columns):
+    config = sa.text(f"'{TEXT_SEARCH_CONFIG}'")
+    vectors = [sa.func.to_tsvector(config, sa.func.coalesce(column, sa.text("''"))) for column in columns]
+    vector = vectors[0]
+    for other in vectors[1:]:
+        vector = vector.op('||')(other)
+    return vector
+
+
+def register(table, fields):
+    columns = ', '.join(fields)
+    sa.event.listen(table, 'after_create', sa.DDL(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table(table.name)} USING fts5({columns})'
+    ).execute_if(dialect='sqlite'))
+    sa.event.listen(table, 'after_drop', sa.DDL(
+        f'DROP TABLE IF EXISTS {fts_table(table.name)}'
+    ).execute_if(dialect='sqlite'))
+    sa.Index(f'ix_{table.name}_search', search_vector([table.c[field] for field in fields]),
+             postgresql_using='gin').ddl_if(dialect='postgresql')
+
+
+def id_ranges(model, size):
+    first, last = db.session.execute(sa.select(sa.func.min(model.id), sa.func.max(model.id))).one()
+    if first is None:
+        return []
+    return [(start, min(start + size - 1, last)) for start in range(first, last + 1, size)]
+
+
+def stream_documents(model, first, last):
+    fields = model.__searchable__
+    query = (sa.select(model.id, *[getattr(model, field) for field in fields])
+             .where(model.id.between(first, last))
+             .order_by(model.id)
+             .execution_options(yield_per=app.config['ELASTICSEARCH_BULK_SIZE']))
+    for id, *values in db.session.execute(query):
+        yield id, dict(zip(fields, values))
+
+
+def init_worker(flask_app):
+    flask_app.app_context().push()
+    db.engine.dispose(close=False)
+    flask_app.elasticsearch = Elasticsearch(flask_app.config['ELASTICSEARCH_URL'])
+    flask_app.extensions.pop('search_backend', None)
+
+
+def index_range(index, target, first, last):
+    model = searchable_models()[index]
+    indexed = []
+
+    def operations():
+        for id, payload in stream_documents(model, first, last):
+            indexed.append(id)
+            yield 'create', target, id, payload
+
+    errors = bulk_index(operations())
+    db.session.rollback()
+    existing = set(db.session.scalars(sa.select(model.id).where(model.id.between(first, last))))
+    deleted = [id for id in indexed if id not in existing]
+    errors += bulk_index(('delete', target, id, None) for id in deleted)
+    return len(indexed) - len(deleted), errors
+
+
+def index_ranges(index, target, ranges, processes):
+    if processes <= 1 or len(ranges) <= 1:
+        return [index_range(index, target, first, last) for first, last in ranges]
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes, initializer=init_worker, initargs=(app._get_current_object(),)) as pool:
+        return pool.starmap(index_range, [(index, target, first, last) for first, last in ranges], chunksize=1)
+
+
+class ElasticsearchBackend:
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def rebuild_alias(index):
+        return f'{index}-rebuild'
+
+    def mirror(self, operations):
+        mirrored = []
+        for index in {index for action, index, id, payload in operations if action != 'create'}:
+            alias = self.rebuild_alias(index)
+            if self.client.indices.exists_alias(name=alias):
+                mirrored += [((action, alias, id, payload), index)
+                             for action, name, id, payload in operations if name == index]
+        return mirrored
+
+    def record(self, connection, operations):
+        connection.execute(sa.insert(SearchOutbox), [
+            {'action': action, 'index': index, 'document_id': id} for action, index, id, payload in operations
+        ])
+
+    def bulk(self, operations):
+        errors = []
+        operations = iter(operations)
+        while batch := list(islice(operations, app.config['ELASTICSEARCH_BULK_SIZE'])):
+            mirrored = self.mirror(batch)
+            sources = [index for action, index, id, payload in batch] + [index for operation, index in mirrored]
+            batch += [operation for operation, index in mirrored]
+            body = []
+            for action, index, id, payload in batch:
+                body.append({action: {'_index': index, '_id': id}})
+                if action in ('index', 'create'):
+                    body.append(payload)
+            try:
+                response = self.client.bulk(operations=body)
+            except (ApiError, TransportError) as e:
+                app.logger.warning(f'Bulk indexing of {len(batch)} documents failed: {e}')
+                errors.extend({'action': action, 'index': index, 'id': id, 'error': str(e)}
+                              for (action, _, id, payload), index in zip(batch, sources))
+                continue
+            if not response['errors']:
+                continue
+            for item, index in zip(response['items'], sources):
+                action, result = next(iter(item.items()))
+                if 'error' not in result or (action, result['status']) in (('delete', 404), ('create', 409)):
+                    continue
+                app.logger.warning(f'Failed to {action} {result["_index"]}/{result["_id"]}: {result["error"]}')
+                errors.append({'action': action, 'index': index, 'id': result['_id'], 'error': result['error']})
+        return errors
+
+    def query(self, index, query, page, per_page):
+        search = self.client.search(
+            index=index,
+            query={'multi_match': {'query': query, 'fields': ['*']}},
+            from_=(page - 1) * per_page,
+            size=per_page
+        )
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        return ids, search['hits']['total']['value']
+
+    def reindex(self, model, processes):
+        index = model.__tablename__
+        target = f'{index}-{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}'
+        rebuild = self.rebuild_alias(index)
+        if self.client.indices.exists_alias(name=rebuild):
+            for name in self.client.indices.get_alias(name=rebuild):
+                self.client.indices.delete(index=name)
+        # Writes drained from the outbox go to both indices until the swap.
+        self.client.indices.create(index=target, settings={'index': {'refresh_interval': '-1'}},
+                                   aliases={rebuild: {}})
+        ranges = id_ranges(model, app.config['SEARCH_REINDEX_RANGE_SIZE'])
+        last_id = ranges[-1][1] if ranges else 0
+        db.session.rollback()
+        try:
+            results = index_ranges(index, target, ranges, processes)
+            self.client.indices.put_settings(index=target, settings={'index': {'refresh_interval': None}})
+            self.client.indices.refresh(index=target)
+        except Exception:
+            self.client.indices.delete(index=target)
+            raise
+        count = sum(indexed for indexed, errors in results)
+        errors = [error for indexed, range_errors in results for error in range_errors]
+        if errors:
+            app.logger.warning(f'Reindexing {index} into {target} failed for {len(errors)} documents, '
+                               f'keeping the current index')
+            self.client.indices.delete(index=target)
+            return count, errors
+
+        actions = [{'add': {'index': target, 'alias': index}}, {'remove': {'index': target, 'alias': rebuild}}]
+        if self.client.indices.exists_alias(name=index):
+            old = list(self.client.indices.get_alias(name=index))
+            actions = [{'remove': {'index': name, 'alias': index}} for name in old] + actions
+        elif self.client.indices.exists(index=index):
+            old = []
+            actions.append({'remove_index': {'index': index}})
+        else:
+            old = []
+        self.client.indices.update_aliases(actions=actions)
+        for name in old:
+            self.client.indices.delete(index=name)
+
+        recent = stream_documents(model, last_id + 1, db.session.scalar(sa.select(sa.func.max(model.id))) or 0)
+        errors += self.bulk(('index', index, id, payload) for id, payload in recent)
+        return count, errors
+
+
+class SqliteBackend:
+    @staticmethod
+    def match(query):
+        return ' OR '.join(f'"{term}"' for term in search_terms(query))
+
+    def record(self, connection, operations):
+        for index in {index for action, index, id, payload in operations}:
+            table = fts_table(index)
+            connection.execute(sa.text(f'DELETE FROM {table} WHERE rowid = :rowid'),
+                               [{'rowid': id} for action, name, id, payload in operations if name == index])
+            rows = [{'rowid': id, **payload} for action, name, id, payload in operations
+                    if name == index and action == 'index']
+            if rows:
+                fields = [field for field in rows[0] if field != 'rowid']
+                connection.execute(sa.text(
+                    f'INSERT INTO {table} (rowid, {", ".join(fields)}) '
+                    f'VALUES (:rowid, {", ".join(":" + field for field in fields)})'
+                ), rows)
+
+    def bulk(self, operations):
+        operations = iter(operations)
+        while batch := list(islice(operations, app.config['ELASTICSEARCH_BULK_SIZE'])):
+            self.record(db.session.connection(), batch)
+        return []
+
+    def query(self, index, query, page, per_page):
+        match = self.match(query)
+        if not match:
+            return [], 0
+        table = fts_table(index)
+        total = db.session.scalar(sa.text(f'SELECT count(*) FROM {table} WHERE {table} MATCH :match'),
+                                  {'match': match})
+        ids = db.session.scalars(sa.text(
+            f'SELECT rowid FROM {table} WHERE {table} MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset'
+        ), {'match': match, 'limit': per_page, 'offset': (page - 1) * per_page}).all()
+        return ids, total
+
+    def reindex(self, model, processes):
+        table = fts_table(model.__tablename__)
+        fields = ', '.join(model.__searchable__)
+        db.session.execute(sa.text(f'DELETE FROM {table}'))
+        result = db.session.execute(sa.text(
+            f'INSERT INTO {table} (rowid, {fields}) SELECT id, {fields} FROM {model.__tablename__}'
+        ))
+        db.session.execute(sa.text(f"INSERT INTO {table} ({table}) VALUES ('optimize')"))
+        db.session.commit()
+        return result.rowcount, []
+
+
+class PostgresBackend:
+    def record(self, connection, operations):
+        pass
+
+    def bulk(self, operations):
+        return []
+
+    def query(self, index, query, page, per_page):
+        model = searchable_models()[index]
+        vector = search_vector([getattr(model, field) for field in model.__searchable__])
+        terms = search_terms(query)
+        if not terms:
+            return [], 0
+        tsquery = sa.func.to_tsquery(sa.text(f"'{TEXT_SEARCH_CONFIG}'"), ' | '.join(terms))
+        condition = vector.op('@@')(tsquery)
+        total = db.session.scalar(sa.select(sa.func.count()).select_from(model).where(condition))
+        ids = db.session.scalars(sa.select(model.id)
+                                 .where(condition)
+                                 .order_by(sa.func.ts_rank(vector, tsquery).desc(), model.id.desc())
+                                 .limit(per_page)
+                                 .offset((page - 1) * per_page)).all()
+        return ids, total
+
+    def reindex(self, model, processes):
+        return db.session.scalar(sa.select(sa.func.count()).select_from(model)), []
+
+
+DATABASE_BACKENDS = {'sqlite': SqliteBackend, 'postgresql': PostgresBackend}
+
+
+def search_backend():
+    if 'search_backend' not in app.extensions:
+        if app.elasticsearch:
+            backend = ElasticsearchBackend(app.elasticsearch)
+        else:
+            backend = DATABASE_BACKENDS.get(db.engine.dialect.name, lambda: None)()
+        app.extensions['search_backend'] = backend
+    return app.extensions['search_backend']
+
+
+def bulk_index(operations):
+    backend = search_backend()
+    return backend.bulk(operations) if backend else []
+
 
 def add_to_index(index, model):
-    if not app.elasticsearch:
-        return
-    payload = {}
-    for field in model.__searchable__:
-        payload[field] = getattr(model, field)
-    app.elasticsearch.index(index=index, id=model.id, document=payload)
+    return bulk_index([('index', index, model.id, document(model))])
 
 
 def remove_from_index(index, model):
-    if not app.elasticsearch:
-        return
-    app.elasticsearch.delete(index=index, id=model.id)
+    return bulk_index([('delete', index, model.id, None)])
+
+
+def drain_outbox(batch_size):
+    now = datetime.now(timezone.utc)
+    query = (sa.select(SearchOutbox)
+             .where(SearchOutbox.available_at <= now)
+             .order_by(SearchOutbox.id)
+             .limit(batch_size)
+             .with_for_update(skip_locked=True))
+    entries = db.session.scalars(query).all()
+    if not entries:
+        return 0, 0
+    keys = dict.fromkeys((entry.index, entry.document_id) for entry in entries)
+
+    models = searchable_models()
+    documents = {}
+    for index in {index for index, _ in keys}:
+        ids = [id for name, id in keys if name == index]
+        if index in models:
+            model = models[index]
+            for obj in db.session.scalars(sa.select(model).where(model.id.in_(ids))):
+                documents[index, obj.id] = document(obj)
+    operations = [('index', index, id, documents[index, id]) if (index, id) in documents
+                  else ('delete', index, id, None)
+                  for index, id in keys]
+    failed = {(error['index'], str(error['id'])) for error in bulk_index(operations)}
+
+    retry = {(entry.index, entry.document_id): entry for entry in entries
+             if (entry.index, str(entry.document_id)) in failed}
+    done = [entry.id for entry in entries if retry.get((entry.index, entry.document_id)) is not entry]
+    if done:
+        db.session.execute(sa.delete(SearchOutbox).where(SearchOutbox.id.in_(done)))
+    for entry in retry.values():
+        entry.attempts += 1
+        if entry.attempts >= app.config['SEARCH_OUTBOX_MAX_ATTEMPTS']:
+            app.logger.error(f'Giving up on {entry.action} {entry.index}/{entry.document_id} '
+                             f'after {entry.attempts} attempts')
+            db.session.delete(entry)
+        else:
+            delay = min(app.config['SEARCH_OUTBOX_RETRY_DELAY'] * 2 ** (entry.attempts - 1),
+                        app.config['SEARCH_OUTBOX_MAX_RETRY_DELAY'])
+            entry.available_at = now + timedelta(seconds=delay)
+    db.session.commit()
+    for index in {index for index, _ in keys}:
+        bump_generation(index)
+    return len(operations), len(retry)
 
 
 def query_index(index, query, page, per_page):
-    if not app.elasticsearch:
-        return
-    search = app.elasticsearch.search(
-        index=index,
-        query={'multi_match': {'query': query, 'fields': ['*']}},
-        from_=(page - 1) * per_page,
-        size=per_page
-    )
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+    backend = search_backend()
+    return backend.query(index, query, page, per_page) if backend else ([], 0)
+
+
+def search_cache():
+    return get_cache('search', app.config['SEARCH_CACHE_SIZE'], app.config['SEARCH_CACHE_TTL'])
+
+
+def search_generations():
+    return get_cache('search_generation', len(searchable_models()) or 1, app.config['SEARCH_CACHE_TTL'])
+
+
+def bump_generation(index):
+    search_generations().incr(index)
+
 
+def cached_query(index, query, page, per_page):
+    query = ' '.join(query.casefold().split())
+    generation = search_generations().get(index) or 0
+    key = f'{index}:{generation}:{page}:{per_page}:{md5(query.encode("utf-8")).hexdigest()}'
+    cache = search_cache()
+    result = cache.get(key)
+    if result is None:
+        result = query_index(index, query, page, per_page)
+        cache.set(key, result)
+    ids, total = result
+    return ids, total
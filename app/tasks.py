@@ -1,8 +1,10 @@
 import json
 import sys
 import time
+from time import monotonic
 from celery import shared_task
 from app import db
+from app.models.notification import Notification
 from app.models.task import Task
 from app.models.user import User
 from app.models.post import Post
@@ -11,23 +13,89 @@ from app import mail
 from flask import current_app as app, render_template
 import sqlalchemy as sa
 from app.email import send_email
+from app.broadcast import broadcast, member_count
+from app.search import drain_outbox
 
 
-def _set_task_progress(job, progress):
-    job.update_state(
-        state='PROGRESS',
-        meta={
-            'progress': progress
-        }
-    )
-    task = db.session.get(Task, job.request.id)
-    task.user.add_notification('task_progress', {'task_id': job.request.id, 'progress': progress})
-    if progress >= 100:
-        job.update_state(
-            state='SUCCESS',
+class ProgressReporter:
+    def __init__(self, job, step=None, interval=None):
+        self.job = job
+        self.task = db.session.get(Task, job.request.id)
+        self.step = step or app.config['TASK_PROGRESS_STEP']
+        self.interval = interval or app.config['TASK_PROGRESS_INTERVAL']
+        self.reported = None
+        self.reported_at = 0
+
+    def update(self, progress):
+        if progress == self.reported:
+            return
+        if (self.reported is not None and progress - self.reported < self.step
+                and monotonic() - self.reported_at < self.interval):
+            return
+        self.job.update_state(
+            state='PROGRESS',
+            meta={
+                'progress': progress
+            }
         )
-        task.complete = True
-    db.session.commit()
+        self._notify(progress)
+        db.session.commit()
+
+    def finish(self):
+        self._notify(100)
+        self.task.complete = True
+        db.session.commit()
+
+    def _notify(self, progress):
+        self.task.user.add_notification('task_progress', {'task_id': self.job.request.id, 'progress': progress})
+        self.reported = progress
+        self.reported_at = monotonic()
+
+
+@shared_task
+def prune_notifications():
+    cutoff = time.time() - app.config['NOTIFICATION_RETENTION_DAYS'] * 86400
+    query = (sa.select(Notification.id)
+             .where(Notification.timestamp < cutoff)
+             .limit(app.config['NOTIFICATION_PRUNE_BATCH_SIZE']))
+    start = monotonic()
+    deleted = 0
+    while ids := db.session.scalars(query).all():
+        db.session.execute(sa.delete(Notification).where(Notification.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+    app.logger.info(f'Pruned {deleted} notifications in {monotonic() - start:.2f}s')
+    return deleted
+
+
+@shared_task
+def drain_search_outbox():
+    batch_size = app.config['SEARCH_OUTBOX_BATCH_SIZE']
+    start = monotonic()
+    indexed = failed = 0
+    while True:
+        done, errors = drain_outbox(batch_size)
+        indexed += done - errors
+        failed += errors
+        if not done or errors:
+            break
+    if indexed or failed:
+        app.logger.info(f'Indexed {indexed} search documents in {monotonic() - start:.2f}s, {failed} failed')
+    return indexed
+
+
+@shared_task(bind=True)
+def broadcast_task(self, user_id, group_id, body):
+    progress = ProgressReporter(self)
+    total = member_count(group_id, user_id) or 1
+    try:
+        sent, elapsed = broadcast(group_id, user_id, body, app.config['GROUP_BROADCAST_CHUNK_SIZE'],
+                                  on_chunk=lambda sent: progress.update(100 * sent // total))
+        app.logger.info(f'Broadcast to group {group_id}: {sent} messages in {elapsed:.2f}s '
+                        f'({sent / elapsed if elapsed else 0:.0f} messages/s)')
+        return sent
+    finally:
+        progress.finish()
 
 
 @shared_task(max_retries=3)
@@ -42,6 +110,7 @@ def send_email(subject, sender, recipients, text_body, html_body, attachments=No
 @shared_task(bind=True, max_retries=3)
 def export_posts_task(self, user_id):
     user = db.session.get(User, user_id)
+    progress = ProgressReporter(self)
     try:
         data = []
         i = 0
@@ -54,17 +123,7 @@ def export_posts_task(self, user_id):
             data.append({'body': post.body, 'timestamp': post.timestamp.isoformat() + 'Z'})
             time.sleep(3)
             i += 1
-            progress = 100 * i // total_posts
-            self.update_state(
-                state='PROGRESS',
-                meta={
-                    'progress': progress
-                }
-            )
-            task = db.session.get(Task, self.request.id)
-            task.user.add_notification('task_progress', {'task_id': self.request.id, 'progress': progress})
-            db.session.commit()
-            # _set_task_progress(self, 100 * i // total_posts)
+            progress.update(100 * i // total_posts)
         send_email(
             'Экспорт постов',
             sender=app.config['ADMINS'][0], recipients=[user.email],
@@ -74,7 +133,6 @@ def export_posts_task(self, user_id):
         )
     except Exception as e:
         app.logger.error(f"Exception: ${e}, ${e.args}", exc_info=sys.exc_info())
-        # _set_task_progress(self, 100)
         self.update_state(
             state='FAILURE',
             meta={
@@ -82,8 +140,4 @@ def export_posts_task(self, user_id):
             }
         )
     finally:
-        # _set_task_progress(self, 100)
-        task = db.session.get(Task, self.request.id)
-        task.user.add_notification('task_progress', {'task_id': self.request.id, 'progress': 100})
-        task.complete = True
-        db.session.commit()
+        progress.finish()
@@ -0,0 +1,134 @@
+import hashlib
+import secrets
+from threading import Lock
+from time import time, monotonic
+
+import jwt
+from flask import current_app as app
+from redis.exceptions import RedisError
+
+
+class BloomFilter:
+    def __init__(self, size, hashes):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(size // 8 + 1)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(value))
+
+
+class LocalRevocationStore:
+    def __init__(self):
+        self.tokens = {}
+        self.lock = Lock()
+
+    def add(self, jti, expires):
+        with self.lock:
+            self.tokens[jti] = expires
+
+    def __contains__(self, jti):
+        return jti in self.tokens
+
+    def active(self):
+        now = time()
+        with self.lock:
+            self.tokens = {jti: expires for jti, expires in self.tokens.items() if expires > now}
+            return list(self.tokens)
+
+
+class RedisRevocationStore:
+    key = 'api:revoked_tokens'
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def add(self, jti, expires):
+        self.redis.zadd(self.key, {jti: expires})
+
+    def __contains__(self, jti):
+        return self.redis.zscore(self.key, jti) is not None
+
+    def active(self):
+        pipeline = self.redis.pipeline()
+        pipeline.zremrangebyscore(self.key, '-inf', time())
+        pipeline.zrange(self.key, 0, -1)
+        return [jti.decode('utf-8') for jti in pipeline.execute()[1]]
+
+
+class RevocationList:
+    def __init__(self, store, size, hashes, interval):
+        self.store = store
+        self.size = size
+        self.hashes = hashes
+        self.interval = interval
+        self.bloom = BloomFilter(size, hashes)
+        self.synced_at = None
+        self.lock = Lock()
+
+    def sync(self):
+        with self.lock:
+            bloom = BloomFilter(self.size, self.hashes)
+            for jti in self.store.active():
+                bloom.add(jti)
+            self.bloom = bloom
+            self.synced_at = monotonic()
+
+    def revoke(self, jti, expires):
+        with self.lock:
+            self.store.add(jti, expires)
+            self.bloom.add(jti)
+
+    def is_revoked(self, jti):
+        try:
+            if self.synced_at is None or monotonic() - self.synced_at > self.interval:
+                self.sync()
+            return jti in self.bloom and jti in self.store
+        except RedisError as e:
+            app.logger.warning(f'Token revocation list is unavailable: {e}')
+            return True
+
+
+def revocations():
+    if 'revocations' not in app.extensions:
+        store = RedisRevocationStore(app.redis) if app.redis else LocalRevocationStore()
+        app.extensions['revocations'] = RevocationList(store, app.config['TOKEN_BLOOM_SIZE'],
+                                                       app.config['TOKEN_BLOOM_HASHES'],
+                                                       app.config['TOKEN_REVOCATION_SYNC_INTERVAL'])
+    return app.extensions['revocations']
+
+
+class TokenIdentity:
+    def __init__(self, id, jti, expires):
+        self.id = id
+        self.jti = jti
+        self.expires = expires
+
+    def revoke_token(self):
+        revocations().revoke(self.jti, self.expires)
+
+
+def issue_token(user_id, expires_in):
+    return jwt.encode(
+        {'api_token': user_id, 'jti': secrets.token_hex(16), 'exp': time() + expires_in},
+        app.config['SECRET_KEY'], algorithm='HS256'
+    )
+
+
+def verify_token(token):
+    try:
+        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    if 'api_token' not in payload or 'jti' not in payload or revocations().is_revoked(payload['jti']):
+        return None
+    return TokenIdentity(payload['api_token'], payload['jti'], payload['exp'])
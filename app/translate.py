@@ -1,17 +1,104 @@
+from datetime import datetime, timezone
+from hashlib import sha256
+
 import requests
+import sqlalchemy as sa
 from flask import current_app as app
+from requests.adapters import HTTPAdapter
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models.translation import Translation
+
+ERROR = 'При переводе произошла ошибка'
+
+
+class MicrosoftTranslator:
+    url = 'https://api.cognitive.microsofttranslator.com/translate'
+
+    def __init__(self, key, region, timeout, pool_size):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Ocp-Apim-Subscription-Key': key,
+            'Ocp-Apim-Subscription-Region': region,
+        })
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=1))
+
+    def translate(self, texts, source_language, dest_language):
+        r = self.session.post(self.url, params={'api-version': '3.0', 'from': source_language, 'to': dest_language},
+                              json=[{'Text': text} for text in texts], timeout=self.timeout)
+        r.raise_for_status()
+        return [item['translations'][0]['text'] for item in r.json()]
+
+
+class StubTranslator:
+    def __init__(self):
+        self.requests = []
+
+    def translate(self, texts, source_language, dest_language):
+        self.requests.append(list(texts))
+        return [f'[{dest_language}] {text}' for text in texts]
+
+
+def translator():
+    if 'translator' not in app.extensions:
+        if app.config['TRANSLATOR_PROVIDER'] == 'stub':
+            provider = StubTranslator()
+        elif app.config['TRANSLATOR_KEY']:
+            provider = MicrosoftTranslator(app.config['TRANSLATOR_KEY'], app.config['TRANSLATOR_REGION'],
+                                           app.config['TRANSLATOR_TIMEOUT'], app.config['TRANSLATOR_POOL_SIZE'])
+        else:
+            provider = None
+        app.extensions['translator'] = provider
+    return app.extensions['translator']
+
+
+def text_hash(text):
+    return sha256(text.encode('utf-8')).hexdigest()
+
+
+def store_translations(rows):
+    insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(db.engine.dialect.name)
+    with db.engine.begin() as connection:
+        if insert is None:
+            hashes = [row['text_hash'] for row in rows]
+            connection.execute(sa.delete(Translation).where(
+                Translation.text_hash.in_(hashes),
+                Translation.source_language == rows[0]['source_language'],
+                Translation.dest_language == rows[0]['dest_language'],
+            ))
+            connection.execute(sa.insert(Translation), rows)
+        else:
+            connection.execute(insert(Translation).on_conflict_do_nothing(), rows)
+
+
+def translate_many(texts, source_language, dest_language):
+    hashes = {text: text_hash(text) for text in texts}
+    query = sa.select(Translation.text_hash, Translation.text).where(
+        Translation.text_hash.in_(set(hashes.values())),
+        Translation.source_language == source_language,
+        Translation.dest_language == dest_language,
+    )
+    cached = dict(db.session.execute(query).all()) if hashes else {}
+    missing = [text for text, hash in hashes.items() if hash not in cached]
+    provider = translator()
+    if missing and provider is not None:
+        size = app.config['TRANSLATOR_BATCH_SIZE']
+        now = datetime.now(timezone.utc)
+        try:
+            for start in range(0, len(missing), size):
+                batch = missing[start:start + size]
+                results = provider.translate(batch, source_language, dest_language)
+                rows = [{'text_hash': hashes[text], 'source_language': source_language,
+                         'dest_language': dest_language, 'text': result, 'timestamp': now}
+                        for text, result in zip(batch, results)]
+                store_translations(rows)
+                cached.update((row['text_hash'], row['text']) for row in rows)
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            app.logger.warning(f'Translation of {len(missing)} texts failed: {e}')
+    return [cached.get(hashes[text], ERROR) for text in texts]
 
 
 def translate(text, source_language, dest_language):
-    error: str = 'При переводе произошла ошибка'
-    if 'TRANSLATOR_KEY' not in app.config or not app.config['TRANSLATOR_KEY']:
-        return error
-    auth = {
-        'Ocp-Apim-Subscription-Key': app.config['TRANSLATOR_KEY'],
-        'Ocp-Apim-Subscription-Region': 'westus',
-    }
-    r = requests.post('https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&from={}&to={}'.format(
-            source_language, dest_language), headers=auth, json=[{'Text': text}])
-    if r.status_code != 200:
-        return error
-    return r.json()[0]['translations'][0]['text']
+    return translate_many([text], source_language, dest_language)[0]
@@ -0,0 +1,137 @@
+import heapq
+from bisect import bisect_left, insort
+from threading import Lock
+from time import monotonic
+
+import sqlalchemy as sa
+from flask import current_app as app
+
+from app import db
+from app.models.user import User
+
+MEMO_RANGE = 64
+
+
+class UsernameIndex:
+    def __init__(self, ttl, size, memo_range=MEMO_RANGE):
+        self.ttl = ttl
+        self.size = size
+        self.memo_range = memo_range
+        self.keys = []
+        self.users = {}
+        self.top = {}
+        self.loaded_at = None
+        self.lock = Lock()
+        self.reload_lock = Lock()
+
+    def load(self, rows):
+        users = {id: (username, followers) for id, username, followers in rows}
+        keys = sorted((username.casefold(), id) for id, (username, followers) in users.items())
+        with self.lock:
+            self.users = users
+            self.keys = keys
+            self.top = {}
+            self.loaded_at = monotonic()
+
+    def is_warm(self):
+        return self.loaded_at is not None and monotonic() - self.loaded_at < self.ttl
+
+    def refresh(self, rows):
+        # Only one caller reloads; the rest keep serving the stale index unless there is nothing to serve yet.
+        if not self.reload_lock.acquire(blocking=self.loaded_at is None):
+            return
+        try:
+            if not self.is_warm():
+                self.load(rows())
+        finally:
+            self.reload_lock.release()
+
+    def add(self, id, username, followers=None):
+        with self.lock:
+            if followers is None:
+                followers = self.users.get(id, (username, 0))[1]
+            self._remove(id)
+            insort(self.keys, (username.casefold(), id))
+            self.users[id] = (username, followers)
+            self._forget(username.casefold())
+
+    def remove(self, id):
+        with self.lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        entry = self.users.pop(id, None)
+        if entry is None:
+            return
+        key = (entry[0].casefold(), id)
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+        self._forget(key[0])
+
+    def _forget(self, key):
+        for length in range(len(key) + 1):
+            self.top.pop(key[:length], None)
+
+    def complete(self, prefix, limit):
+        prefix = prefix.casefold()
+        with self.lock:
+            if prefix in self.top and limit <= self.size:
+                return self.top[prefix][:limit]
+            start = bisect_left(self.keys, (prefix,))
+            end = bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+            memo = end - start > self.memo_range and limit <= self.size
+            candidates = (self.keys[position] for position in range(start, end))
+            best = heapq.nlargest(self.size if memo else limit, candidates, key=lambda key: self.users[key[1]][1])
+            result = [(id, *self.users[id]) for _, id in best]
+            if memo:
+                self.top[prefix] = result
+            return result[:limit]
+
+
+def username_index():
+    if 'username_index' not in app.extensions:
+        app.extensions['username_index'] = UsernameIndex(app.config['USERNAME_INDEX_TTL'],
+                                                         app.config['USERNAME_AUTOCOMPLETE_LIMIT'])
+    index = app.extensions['username_index']
+    if not index.is_warm():
+        index.refresh(lambda: db.session.execute(sa.select(User.id, User.username, User.follower_counter)).all())
+    return index
+
+
+def complete_usernames(prefix, limit):
+    return username_index().complete(prefix, limit)
+
+
+def after_flush(session, flush_context):
+    changes = session.info.setdefault('usernames', {})
+    for obj in session.new:
+        if isinstance(obj, User):
+            changes[obj.id] = (obj.username, 0)
+    for obj in session.dirty:
+        if isinstance(obj, User) and sa.inspect(obj).attrs.username.history.has_changes():
+            changes[obj.id] = (obj.username, None)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changes[obj.id] = None
+
+
+def after_commit(session):
+    changes = session.info.pop('usernames', None)
+    index = app.extensions.get('username_index')
+    if not changes or index is None:
+        return
+    for id, entry in changes.items():
+        if entry is None:
+            index.remove(id)
+        else:
+            index.add(id, *entry)
+
+
+def after_rollback(session):
+    session.info.pop('usernames', None)
+
+
+db.event.listen(db.session, 'after_flush', after_flush)
+db.event.listen(db.session, 'after_commit', after_commit)
+db.event.listen(db.session, 'after_rollback', after_rollback)
@@ -0,0 +1,115 @@
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from hashlib import md5
+from typing import Optional
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app as app
+
+from app import db, login
+from app.cache import get_cache
+from app.models.user import User
+
+CACHED_FIELDS = ('username', 'email', 'about_me', 'last_seen')
+
+
+@dataclass(frozen=True)
+class UserRecord:
+    id: int
+    username: str
+    email_digest: str
+    about_me: Optional[str]
+    last_seen: Optional[datetime]
+
+    def avatar(self, size):
+        return f'https://www.gravatar.com/avatar/{self.email_digest}?d=identicon&s={size}'
+
+    def attach(self):
+        user = db.session.identity_map.get(db.session.identity_key(User, self.id))
+        if user is None:
+            user = User(id=self.id, username=self.username, about_me=self.about_me, last_seen=self.last_seen)
+            so.make_transient_to_detached(user)
+            db.session.add(user)
+        return user
+
+    def to_dict(self):
+        data = asdict(self)
+        data['last_seen'] = self.last_seen.isoformat() if self.last_seen else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        last_seen = datetime.fromisoformat(data['last_seen']) if data['last_seen'] else None
+        return cls(**dict(data, last_seen=last_seen))
+
+
+def user_cache():
+    return get_cache('users', app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+
+def _load_user(key, condition):
+    cache = user_cache()
+    data = cache.get(key)
+    if data is not None:
+        return UserRecord.from_dict(data)
+    query = sa.select(User.id, User.username, User.email, User.about_me, User.last_seen).where(condition)
+    row = db.session.execute(query).first()
+    if row is None:
+        return None
+    record = UserRecord(
+        id=row.id,
+        username=row.username,
+        email_digest=md5(row.email.lower().encode('utf-8')).hexdigest(),
+        about_me=row.about_me,
+        last_seen=row.last_seen,
+    )
+    cache.set(f'id:{record.id}', record.to_dict())
+    cache.set(f'username:{record.username}', record.to_dict())
+    return record
+
+
+def get_user(id):
+    return _load_user(f'id:{id}', User.id == id)
+
+
+def find_user(username):
+    return _load_user(f'username:{username}', User.username == username)
+
+
+@login.user_loader
+def load_user(user_id):
+    record = get_user(int(user_id))
+    return record.attach() if record else None
+
+
+def _changed_keys(user, deleted):
+    state = sa.inspect(user)
+    if not deleted and not any(state.attrs[field].history.has_changes() for field in CACHED_FIELDS):
+        return []
+    history = state.attrs.username.history
+    usernames = set(history.deleted or ()) | set(history.unchanged or ()) | set(history.added or ())
+    return [f'id:{user.id}'] + [f'username:{username}' for username in usernames]
+
+
+def after_flush(session, flush_context):
+    keys = [key for obj in session.dirty if isinstance(obj, User) for key in _changed_keys(obj, False)]
+    keys += [key for obj in session.deleted if isinstance(obj, User) for key in _changed_keys(obj, True)]
+    if keys:
+        user_cache().delete(*keys)
+        session.info.setdefault('stale_users', set()).update(keys)
+
+
+def after_commit(session):
+    keys = session.info.pop('stale_users', None)
+    if keys:
+        user_cache().delete(*keys)
+
+
+def after_rollback(session):
+    session.info.pop('stale_users', None)
+
+
+db.event.listen(db.session, 'after_flush', after_flush)
+db.event.listen(db.session, 'after_commit', after_commit)
+db.event.listen(db.session, 'after_rollback', after_rollback)
@@ -8,4 +8,5 @@ while true; do
     echo Upgrade command failed, retrying in 5 secs...
     sleep 5
 done
-exec gunicorn -b :5000 --access-logfile - --error-logfile - microblog:app
\ No newline at end of file
+exec gunicorn -b :5000 -k gevent --worker-connections "${GUNICORN_WORKER_CONNECTIONS:-1000}" \
+    --access-logfile - --error-logfile - microblog:app
\ No newline at end of file
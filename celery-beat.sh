@@ -0,0 +1,2 @@
+#!/bin/bash
+exec celery -A make_celery.celery_app beat --loglevel INFO
\ No newline at end of file
@@ -18,10 +18,63 @@ class BaseConfig:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['develop.nikita@yandex.ru']
     TRANSLATOR_KEY = os.environ.get('TRANSLATOR_KEY')
+    TRANSLATOR_PROVIDER = os.environ.get('TRANSLATOR_PROVIDER', 'microsoft')
+    TRANSLATOR_REGION = os.environ.get('TRANSLATOR_REGION', 'westus')
+    TRANSLATOR_TIMEOUT = float(os.environ.get('TRANSLATOR_TIMEOUT') or 5)
+    TRANSLATOR_POOL_SIZE = int(os.environ.get('TRANSLATOR_POOL_SIZE') or 10)
+    TRANSLATOR_BATCH_SIZE = int(os.environ.get('TRANSLATOR_BATCH_SIZE') or 100)
     POSTS_PER_PAGE = 5
+    PAGINATION_MODE = os.environ.get('PAGINATION_MODE', 'offset')
+    PAGINATION_COUNT_STRATEGY = os.environ.get('PAGINATION_COUNT_STRATEGY', 'exact')
+    PAGINATION_COUNT_STRATEGIES = {
+        'main.index': 'none',
+        'main.explore': 'none',
+        'main.user': 'none',
+        'main.messages': 'none',
+    }
+    COUNT_CACHE_SIZE = 10000
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL') or 60)
     LANGUAGES = ['ru', 'en']
     REDIS_URL = os.environ.get('REDIS_URL', "redis://localhost")
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL', 'http://localhost:9200')
+    ELASTICSEARCH_BULK_SIZE = int(os.environ.get('ELASTICSEARCH_BULK_SIZE') or 500)
+    SEARCH_REINDEX_RANGE_SIZE = int(os.environ.get('SEARCH_REINDEX_RANGE_SIZE') or 50000)
+    SEARCH_REINDEX_PROCESSES = int(os.environ.get('SEARCH_REINDEX_PROCESSES') or os.cpu_count() or 1)
+    SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE') or 1000)
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL') or 60)
+    SEARCH_OUTBOX_INTERVAL = float(os.environ.get('SEARCH_OUTBOX_INTERVAL') or 5)
+    SEARCH_OUTBOX_BATCH_SIZE = int(os.environ.get('SEARCH_OUTBOX_BATCH_SIZE') or 1000)
+    SEARCH_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('SEARCH_OUTBOX_MAX_ATTEMPTS') or 10)
+    SEARCH_OUTBOX_RETRY_DELAY = 5
+    SEARCH_OUTBOX_MAX_RETRY_DELAY = 3600
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 4)
+    API_TOKEN_FORMAT = os.environ.get('API_TOKEN_FORMAT', 'opaque')
+    TOKEN_REVOCATION_SYNC_INTERVAL = int(os.environ.get('TOKEN_REVOCATION_SYNC_INTERVAL') or 5)
+    TOKEN_BLOOM_SIZE = 1 << 20
+    TOKEN_BLOOM_HASHES = 7
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+    USERNAME_INDEX_TTL = int(os.environ.get('USERNAME_INDEX_TTL') or 300)
+    USERNAME_AUTOCOMPLETE_LIMIT = 20
+    PRESENCE_GRANULARITY = int(os.environ.get('PRESENCE_GRANULARITY') or 60)
+    PRESENCE_FLUSH_INTERVAL = int(os.environ.get('PRESENCE_FLUSH_INTERVAL') or 30)
+    NOTIFICATION_STREAM_KEEPALIVE = int(os.environ.get('NOTIFICATION_STREAM_KEEPALIVE') or 15)
+    NOTIFICATION_STREAM_TIMEOUT = int(os.environ.get('NOTIFICATION_STREAM_TIMEOUT') or 300)
+    TASK_PROGRESS_STEP = int(os.environ.get('TASK_PROGRESS_STEP') or 5)
+    TASK_PROGRESS_INTERVAL = float(os.environ.get('TASK_PROGRESS_INTERVAL') or 2)
+    NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS') or 30)
+    NOTIFICATION_PRUNE_BATCH_SIZE = int(os.environ.get('NOTIFICATION_PRUNE_BATCH_SIZE') or 1000)
+    NOTIFICATION_PRUNE_INTERVAL = int(os.environ.get('NOTIFICATION_PRUNE_INTERVAL') or 3600)
+    GROUP_BROADCAST_CHUNK_SIZE = int(os.environ.get('GROUP_BROADCAST_CHUNK_SIZE') or 1000)
+    GROUP_BROADCAST_SYNC_LIMIT = int(os.environ.get('GROUP_BROADCAST_SYNC_LIMIT') or 200)
+    HOME_TIMELINE = os.environ.get('HOME_TIMELINE') is not None
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or 10000)
+    FOLLOWING_POSTS_STRATEGY = os.environ.get('FOLLOWING_POSTS_STRATEGY', 'join')
+    EXPLORE_CACHE_SIZE = int(os.environ.get('EXPLORE_CACHE_SIZE') or 500)
+    EXPLORE_CACHE_PAGES = int(os.environ.get('EXPLORE_CACHE_PAGES') or 10)
+    EXPLORE_CACHE_TTL = int(os.environ.get('EXPLORE_CACHE_TTL') or 60)
 
     @staticmethod
     def init_app(app):
@@ -32,6 +85,8 @@ class TestConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
     ELASTICSEARCH_URL = None
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    TRANSLATOR_PROVIDER = 'stub'
 
 
 class DevelopmentConfig(BaseConfig):
@@ -0,0 +1,4 @@
+def post_fork(server, worker):
+    if server.cfg.worker_class_str == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
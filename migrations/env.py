@@ -1,4 +1,5 @@
 import logging
+import re
 from logging.config import fileConfig
 
 from flask import current_app
@@ -90,9 +91,15 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # full-text search tables are created outside of the models metadata
+    def include_object(object, name, type_, reflected, compare_to):
+        return not (type_ == 'table' and reflected and compare_to is None and re.fullmatch(r'\w+_fts(_\w+)?', name))
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
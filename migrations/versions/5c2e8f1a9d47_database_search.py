@@ -0,0 +1,34 @@
+"""database search
+
+Revision ID: 5c2e8f1a9d47
+Revises: 16b30d27bcb2
+Create Date: 2026-10-18 21:02:11.417306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8f1a9d47'
+down_revision = '16b30d27bcb2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(body)')
+        op.execute('INSERT INTO post_fts (rowid, body) SELECT id, body FROM post')
+    elif dialect == 'postgresql':
+        op.create_index('ix_post_search', 'post', [sa.text("to_tsvector('simple', coalesce(body, ''))")],
+                        postgresql_using='gin')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS post_fts')
+    elif dialect == 'postgresql':
+        op.drop_index('ix_post_search', table_name='post')
@@ -1,8 +1,32 @@
 from datetime import datetime, timezone, timedelta
+import base64
+import json
 import unittest
+import sqlalchemy as sa
+from flask import url_for
 from app import create_app, db
-from app.models.user import User
+from app.models.user import User, FOLLOWING_POSTS_STRATEGIES
 from app.models.post import Post
+from app.models.message import Message
+from app.models.conversation import Conversation, ConversationMember
+from app.pagination import CountedPagination, KeysetPagination
+from app.feeds import explore_page
+from app.models.mixins import url_template
+from app.benchmarks import benchmark_following_posts, busiest_followers
+from app.main.hydration import hydrate_posts, hydrate_users
+from app.presence import presence
+from app.users import find_user, get_user
+from app.usernames import UsernameIndex, complete_usernames, username_index
+from app.events import notification_bus
+from app.models.notification import Notification
+from app.models.task import Task
+from app.tasks import ProgressReporter, prune_notifications, drain_search_outbox
+from app.models.group import Group, Membership
+from app.models.outbox import SearchOutbox
+from app.broadcast import broadcast
+from app.search import query_index
+from app.translate import translate, translate_many, translator
+from app.models.translation import Translation
 from config import TestConfig
 
 
@@ -24,6 +48,17 @@ class UserModelCase(unittest.TestCase):
         self.assertFalse(user.check_password('000'))
         self.assertTrue(user.check_password('123'))
 
+    def test_password_rehash(self):
+        user = User(username='Иван', email='ivan@example.com')
+        user.set_password('123')
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertFalse(user.check_password('000'))
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(user.check_password('123'))
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(user.check_password('123'))
+
     def test_avatar(self):
         user = User(username='Петр', email='petr@example.com')
         self.assertEqual(user.avatar(128), ('https://www.gravatar.com/avatar/'
@@ -57,6 +92,47 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(user1.following_count(), 0)
         self.assertEqual(user2.followers_count(), 0)
 
+    def test_counters(self):
+        user1 = User(username='Иван', email='ivan@example.com')
+        user2 = User(username='Петр', email='petr@example.com')
+        post1 = Post(body="Пост Ивана", author=user1)
+        post2 = Post(body="Еще один пост Ивана", author=user1)
+        db.session.add_all([user1, user2, post1, post2])
+        db.session.commit()
+        self.assertEqual(user1.posts_count(), 2)
+
+        db.session.add(Post(body="Третий пост Ивана", author=user1))
+        db.session.delete(post1)
+        db.session.add(Post(body="Четвертый пост Ивана", author=user1))
+        db.session.commit()
+        self.assertEqual(user1.posts_count(), 3)
+        db.session.add(Post(body="Пост Петра", user_id=user2.id))
+        db.session.commit()
+        self.assertEqual(user2.posts_count(), 1)
+
+        user2.follow(user1)
+        db.session.commit()
+        self.assertEqual((user1.followers_count(), user2.following_count()), (1, 1))
+
+        now = datetime.now(timezone.utc)
+        db.session.add_all([Message(author=user1, recipient=user2, body='Привет', timestamp=now - timedelta(minutes=2)),
+                            Message(author=user1, recipient=user2, body='Как дела?', timestamp=now)])
+        db.session.commit()
+        self.assertEqual((user1.unread_message_count(), user2.unread_message_count()), (0, 2))
+        user2.read_messages()
+        db.session.add(Message(author=user1, recipient=user2, body='Ответь', timestamp=now + timedelta(minutes=1)))
+        db.session.flush()
+        self.assertEqual(user2.unread_message_count(), 1)
+        db.session.commit()
+
+        db.session.execute(sa.update(User).values(post_counter=0, follower_counter=5, following_counter=5,
+                                                  unread_message_counter=7))
+        User.reconcile_counters()
+        db.session.commit()
+        self.assertEqual((user1.posts_count(), user1.followers_count(), user1.following_count()), (3, 1, 0))
+        self.assertEqual((user2.posts_count(), user2.followers_count(), user2.following_count()), (1, 0, 1))
+        self.assertEqual((user1.unread_message_count(), user2.unread_message_count()), (0, 1))
+
     def test_follow_posts(self):
         user1 = User(username='Иван', email='ivan@example.com')
         user2 = User(username='Петр', email='petr@example.com')
@@ -87,6 +163,748 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(user3_following_posts, [post3, post4])
         self.assertEqual(user4_following_posts, [post4])
 
+    def test_following_posts_strategies(self):
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(4)]
+        db.session.add_all(users)
+        now = datetime.now(timezone.utc)
+        for i in range(12):
+            db.session.add(Post(body=f"Пост {i}", author=users[i % 4], timestamp=now + timedelta(seconds=i // 3)))
+        db.session.commit()
+        users[0].follow(users[1])
+        users[0].follow(users[2])
+        users[1].follow(users[3])
+        db.session.commit()
+
+        for user in users:
+            expected = db.session.scalars(user.following_posts(strategy='join')).all()
+            for strategy in FOLLOWING_POSTS_STRATEGIES:
+                with self.subTest(user=user.username, strategy=strategy):
+                    self.assertEqual(db.session.scalars(user.following_posts(strategy=strategy)).all(), expected)
+                    self.assertEqual(db.session.scalars(user.following_posts(4, strategy).limit(4)).all(),
+                                     expected[:4])
+
+    def test_benchmark_following_posts(self):
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(4)]
+        db.session.add_all(users)
+        now = datetime.now(timezone.utc)
+        for i in range(12):
+            db.session.add(Post(body=f"Пост {i}", author=users[i % 4], timestamp=now + timedelta(seconds=i)))
+        db.session.commit()
+        users[0].follow(users[1])
+        users[0].follow(users[2])
+        users[3].follow(users[1])
+        db.session.commit()
+
+        self.assertEqual(len(db.session.scalars(users[0].following_posts(4, 'topn')).all()), 4)
+        self.assertEqual(busiest_followers(2), [users[0], users[3]])
+        medians, mismatches, best = benchmark_following_posts(busiest_followers(2), 2, 3, 2)
+        self.assertEqual(set(medians), set(FOLLOWING_POSTS_STRATEGIES))
+        self.assertEqual(mismatches, set())
+        self.assertIn(best, FOLLOWING_POSTS_STRATEGIES)
+
+    def test_home_timeline(self):
+        self.app.config['HOME_TIMELINE'] = True
+        user1 = User(username='Иван', email='ivan@example.com')
+        user2 = User(username='Петр', email='petr@example.com')
+        user3 = User(username='Мария', email='maria@example.com')
+        db.session.add_all([user1, user2, user3])
+
+        now = datetime.now(timezone.utc)
+        post1 = Post(body="Пост Ивана", author=user1, timestamp=now + timedelta(seconds=1))
+        post2 = Post(body="Пост Петра", author=user2, timestamp=now + timedelta(seconds=2))
+        db.session.add_all([post1, post2])
+        db.session.commit()
+
+        user1.follow(user2)
+        user1.follow(user3)
+        db.session.commit()
+        post3 = Post(body="Пост Марии", author=user3, timestamp=now + timedelta(seconds=3))
+        db.session.add(post3)
+        db.session.commit()
+
+        self.assertEqual(db.session.scalars(user1.home_timeline()).all(), [post3, post2, post1])
+        self.assertEqual(db.session.scalars(user1.home_timeline()).all(),
+                         db.session.scalars(user1.following_posts()).all())
+
+        user1.unfollow(user2)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(user1.home_timeline()).all(), [post3, post1])
+
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 0
+        post4 = Post(body="Еще один пост Марии", author=user3, timestamp=now + timedelta(seconds=4))
+        db.session.add(post4)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(user1.home_timeline()).all(), [post4, post3, post1])
+
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        user2.follow(user3)
+        db.session.commit()
+        post5 = Post(body="Пост Марии для двоих", author=user3, timestamp=now + timedelta(seconds=5))
+        db.session.add(post5)
+        db.session.commit()
+        user1.unfollow(user3)
+        db.session.commit()
+        self.assertEqual(db.session.scalars(user2.home_timeline()).all(), [post5, post4, post3, post2])
+
+        tied = []
+        for i in range(4):
+            tied.append(Post(body=f"Пост {i}", author=[user2, user3][i % 2], timestamp=now + timedelta(seconds=6)))
+            db.session.add(tied[-1])
+            db.session.commit()
+        expected = sorted(tied, key=lambda post: post.id, reverse=True)
+        self.assertEqual(db.session.scalars(user2.home_timeline()).all()[:4], expected)
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 0
+        self.assertEqual(db.session.scalars(user2.home_timeline()).all()[:4], expected)
+        self.assertEqual(db.session.scalars(user2.home_timeline()).all(),
+                         db.session.scalars(user2.following_posts()).all())
+
+    def test_keyset_pagination(self):
+        user = User(username='Иван', email='ivan@example.com')
+        now = datetime.now(timezone.utc)
+        posts = [Post(body=f"Пост {i}", author=user, timestamp=now + timedelta(seconds=i // 2)) for i in range(5)]
+        db.session.add_all([user, *posts])
+        db.session.commit()
+        expected = db.session.scalars(user.posts.select().order_by(Post.timestamp.desc(), Post.id.desc())).all()
+
+        page = KeysetPagination(user.posts.select(), 2, count=True)
+        self.assertEqual(page.items, expected[:2])
+        self.assertEqual(page.total, 5)
+        self.assertFalse(page.has_prev)
+        page = KeysetPagination(user.posts.select(), 2, after=page.next_cursor)
+        self.assertEqual(page.items, expected[2:4])
+        page = KeysetPagination(user.posts.select(), 2, after=page.next_cursor)
+        self.assertEqual(page.items, expected[4:])
+        self.assertFalse(page.has_next)
+        page = KeysetPagination(user.posts.select(), 2, before=page.prev_cursor)
+        self.assertEqual(page.items, expected[2:4])
+        self.assertTrue(page.has_prev)
+
+        for data in ([['v', {'a': 1}], ['v', 1]], [['v', 'вчера'], ['v', 1]], [['d', now.isoformat()], ['v', '1']],
+                     [['d', now.isoformat()], ['v', True]], {'va': 1}, 5):
+            cursor = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+            with self.subTest(cursor=data):
+                page = KeysetPagination(user.posts.select(), 2, after=cursor)
+                self.assertEqual((page.items, page.has_prev), (expected[:2], False))
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        cursor = base64.urlsafe_b64encode(json.dumps([['v', {'a': 1}], ['v', 1]]).encode()).decode()
+        with self.app.app_context():
+            response = client.get('/explore?after=' + cursor)
+        self.assertEqual(response.status_code, 200)
+
+    def test_url_template(self):
+        for base_url in ('http://localhost/', 'http://localhost/blog/'):
+            with self.app.test_request_context(base_url=base_url):
+                template = url_template('api.get_followers', 'user_id')
+                for id in (1, 987654321, 1987654321):
+                    with self.subTest(base_url=base_url, id=id):
+                        self.assertEqual(template.format(id=id), url_for('api.get_followers', user_id=id))
+        self.assertEqual(url_template('api.get_user', 'user_id'), '/api/users/{id}')
+        with self.assertRaises(ValueError):
+            url_template('api.get_user', 'id')
+
+    def test_explore_cache(self):
+        user = User(username='Иван', email='ivan@example.com')
+        now = datetime.now(timezone.utc)
+        posts = [Post(body=f"Пост {i}", author=user, timestamp=now + timedelta(seconds=i)) for i in range(3)]
+        db.session.add_all([user, *posts])
+        db.session.commit()
+        self.assertEqual(explore_page(1, 2), [posts[2], posts[1]])
+
+        post = Post(body="Новый пост", author=user, timestamp=now + timedelta(seconds=10))
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(explore_page(1, 2), [post, posts[2]])
+
+        db.session.delete(posts[2])
+        db.session.commit()
+        self.assertEqual(explore_page(1, 2), [post, posts[1]])
+        self.assertIsNone(explore_page(2, 2))
+
+        self.app.config['EXPLORE_CACHE_PAGES'] = 1
+        db.session.add_all([Post(body=f"Пост {i}", author=user, timestamp=now + timedelta(seconds=i))
+                            for i in range(20, 23)])
+        db.session.commit()
+        self.assertEqual(len(explore_page(1, 2)), 2)
+        self.assertIsNone(explore_page(2, 2))
+
+        self.app.config['POSTS_PER_PAGE'] = 2
+        for i in range(4):
+            db.session.add(Post(body=f"Одновременный пост {i}", author=user, timestamp=now + timedelta(seconds=30)))
+            db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        pages = []
+        for page in (1, 2):
+            with self.app.app_context():
+                html = client.get(f'/explore?page={page}').get_data(as_text=True)
+            pages.append([i for i in range(4) if f"Одновременный пост {i}" in html])
+        self.assertEqual(pages, [[2, 3], [0, 1]])
+
+    def test_count_strategies(self):
+        user = User(username='Иван', email='ivan@example.com')
+        db.session.add_all([user, *[Post(body=f"Пост {i}", author=user) for i in range(5)]])
+        db.session.commit()
+        query = user.posts.select().order_by(Post.id)
+
+        page = CountedPagination(query, 2, 2, 'none')
+        self.assertIsNone(page.total)
+        self.assertEqual(len(page.items), 2)
+        self.assertTrue(page.has_next)
+        self.assertFalse(CountedPagination(query, 3, 2, 'none').has_next)
+
+        self.assertEqual(CountedPagination(query, 1, 2, 'cached', 'posts').total, 5)
+        db.session.add(Post(body="Новый пост", author=user))
+        db.session.commit()
+        self.assertEqual(CountedPagination(query, 1, 2, 'cached', 'posts').total, 5)
+        self.assertEqual(CountedPagination(query, 1, 2, 'exact').total, 6)
+        self.assertEqual(CountedPagination(query, 1, 2, 'estimate').total, 6)
+        page = CountedPagination(query, 3, 2, 'cached', 'posts')
+        self.assertFalse(page.has_next)
+        self.assertEqual(page.total, 6)
+
+    def test_hydrate_posts(self):
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(6)]
+        db.session.add_all(users)
+        db.session.add_all([Post(body=f"Пост {i}", author=users[i % 6]) for i in range(12)])
+        db.session.commit()
+        users[0].follow(users[1])
+        users[2].follow(users[1])
+        db.session.commit()
+        viewer = users[0]
+        posts = db.session.scalars(sa.select(Post).order_by(Post.id)).all()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        sa.event.listen(db.engine, 'before_cursor_execute', listener)
+        views = hydrate_posts(posts, viewer)
+        sa.event.remove(db.engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(len(statements), 2)
+        self.assertEqual([view.id for view in views], [post.id for post in posts])
+        author = views[1].author
+        self.assertEqual(author.username, 'user1')
+        self.assertTrue(author.is_following)
+        self.assertFalse(views[2].author.is_following)
+        self.assertEqual((author.post_count, author.follower_count, author.following_count), (2, 2, 0))
+        self.assertEqual(author.avatar(36), users[1].avatar(36))
+
+    def test_presence(self):
+        self.app.config['PRESENCE_GRANULARITY'] = 60
+        stored = datetime(2024, 1, 1)
+        user = User(username='Иван', email='ivan@example.com', last_seen=stored)
+        db.session.add(user)
+        db.session.commit()
+        presence().touch(user.id)
+        presence().touch(user.id)
+        self.assertEqual(db.session.scalar(sa.select(User.last_seen).where(User.id == user.id)), stored)
+        seen = hydrate_users([user.id], user)[user.id].last_seen
+        self.assertGreater(seen, stored.replace(tzinfo=timezone.utc))
+        self.assertEqual(seen.timestamp() % 60, 0)
+        self.assertEqual(presence().flush(), 1)
+        self.assertEqual(presence().flush(), 0)
+        db.session.expire_all()
+        self.assertEqual(user.last_seen.replace(tzinfo=timezone.utc), seen)
+        self.assertEqual(hydrate_users([user.id], user)[user.id].last_seen, seen)
+
+    def test_user_cache(self):
+        user = User(username='Иван', email='ivan@example.com', about_me='Привет')
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(find_user('Иван').about_me, 'Привет')
+        avatar = user.avatar(36)
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        sa.event.listen(db.engine, 'before_cursor_execute', listener)
+        record = get_user(user.id)
+        self.assertEqual(find_user('Иван'), record)
+        self.assertEqual(record.avatar(36), avatar)
+        db.session.remove()
+        attached = record.attach()
+        self.assertEqual(attached.username, 'Иван')
+        sa.event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(statements, [])
+
+        attached.username = 'Петр'
+        db.session.commit()
+        self.assertIsNone(find_user('Иван'))
+        self.assertEqual(get_user(user.id).username, 'Петр')
+        self.assertEqual(find_user('Петр').id, user.id)
+
+    def test_notification_stream(self):
+        user = User(username='Иван', email='ivan@example.com')
+        db.session.add(user)
+        db.session.commit()
+        subscription = notification_bus().subscribe(user.id)
+        user.add_notification('unread_message_count', 3)
+        self.assertIsNone(subscription.get(0))
+        db.session.commit()
+        message = subscription.get(0)
+        self.assertEqual((message['name'], message['data']), ('unread_message_count', 3))
+        subscription.close()
+        user.add_notification('unread_message_count', 4)
+        db.session.rollback()
+
+        self.app.config['NOTIFICATION_STREAM_TIMEOUT'] = 0
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        response = client.get('/notifications/stream')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertIn(f'id: {message["timestamp"]}', response.get_data(as_text=True))
+        response = client.get('/notifications/stream', headers={'Last-Event-ID': str(message['timestamp'])})
+        self.assertEqual(response.get_data(as_text=True), '')
+        self.assertFalse(notification_bus().subscriptions)
+
+    def test_notification_upsert(self):
+        user = User(username='Иван', email='ivan@example.com')
+        db.session.add(user)
+        db.session.commit()
+        first = user.add_notification('unread_message_count', 1)
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        sa.event.listen(db.engine, 'before_cursor_execute', listener)
+        second = user.add_notification('unread_message_count', 2)
+        sa.event.remove(db.engine, 'before_cursor_execute', listener)
+        db.session.commit()
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(second.get_data(), 2)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Notification)), 1)
+
+    def test_progress_reporter(self):
+        user = User(username='Иван', email='ivan@example.com')
+        db.session.add_all([user, Task(id='job', name='export', description='Экспорт', user=user)])
+        db.session.commit()
+        states = []
+        job = type('Job', (), {'request': type('Request', (), {'id': 'job'}),
+                               'update_state': lambda self, state, meta: states.append(meta['progress'])})()
+        progress = ProgressReporter(job, step=10, interval=60)
+        for i in range(1, 101):
+            progress.update(i)
+        progress.finish()
+        self.assertEqual(states, [1, 11, 21, 31, 41, 51, 61, 71, 81, 91])
+        notification = db.session.scalar(sa.select(Notification))
+        self.assertEqual(notification.get_data(), {'task_id': 'job', 'progress': 100})
+        self.assertTrue(db.session.get(Task, 'job').complete)
+
+    def test_prune_notifications(self):
+        self.app.config['NOTIFICATION_PRUNE_BATCH_SIZE'] = 2
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)]
+        db.session.add_all(users)
+        db.session.flush()
+        old = datetime.now(timezone.utc) - timedelta(days=self.app.config['NOTIFICATION_RETENTION_DAYS'] + 1)
+        db.session.add_all([Notification(name=name, user=user, payload_json='0', timestamp=old.timestamp())
+                            for user in users for name in ('a', 'b')])
+        db.session.commit()
+        users[0].add_notification('c', 1)
+        db.session.commit()
+        self.assertEqual(prune_notifications(), 6)
+        self.assertEqual(db.session.scalars(sa.select(Notification.name)).all(), ['c'])
+
+    def test_conversations(self):
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        now = datetime.now(timezone.utc)
+        conversation_id = Conversation.between(users[1].id, users[0].id)
+        self.assertEqual(Conversation.between(users[0].id, users[1].id), conversation_id)
+        db.session.add_all([
+            Message(author=users[0], recipient=users[1], body='Привет', conversation_id=conversation_id,
+                    timestamp=now),
+            Message(author=users[0], recipient=users[1], body='Как дела?', timestamp=now + timedelta(seconds=1)),
+            Message(author=users[2], recipient=users[1], body='Здравствуй', timestamp=now + timedelta(seconds=2)),
+        ])
+        db.session.commit()
+        self.assertEqual(len(set(db.session.scalars(sa.select(Message.conversation_id)))), 2)
+
+        inbox = db.session.scalars(sa.select(ConversationMember).filter_by(user_id=users[1].id)
+                                   .order_by(ConversationMember.last_message_at.desc())).all()
+        self.assertEqual([member.peer_id for member in inbox], [users[2].id, users[0].id])
+        self.assertEqual([member.unread_count for member in inbox], [1, 2])
+        sender = ConversationMember.find(users[0].id, users[1].id)
+        self.assertEqual((sender.unread_count, sender.last_message_id), (0, inbox[1].last_message_id))
+        self.assertEqual(users[1].unread_message_count(), 3)
+
+        users[1].read_conversation(inbox[1])
+        db.session.commit()
+        self.assertEqual(users[1].unread_message_count(), 1)
+        self.assertEqual(ConversationMember.find(users[1].id, users[0].id).unread_count, 0)
+
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['POSTS_PER_PAGE'] = 1
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(users[1].id)
+        response = client.get('/messages')
+        self.assertIn('user2', response.get_data(as_text=True))
+        self.assertNotIn('user0', response.get_data(as_text=True))
+        self.assertIn('after=', response.get_data(as_text=True))
+        response = client.get('/messages/user2')
+        self.assertIn('Здравствуй', response.get_data(as_text=True))
+        self.assertEqual(ConversationMember.find(users[1].id, users[2].id).unread_count, 0)
+        self.assertEqual(client.get('/messages/user1').status_code, 302)
+
+        db.session.add(Message(author=users[2], recipient=users[1], body='Ответь', timestamp=now + timedelta(seconds=3)))
+        users[1].add_notification('unread_message_count', 1)
+        db.session.commit()
+        client.get('/messages/user2')
+        notification = db.session.scalar(users[1].notifications.select().filter_by(name='unread_message_count'))
+        self.assertEqual(notification.get_data(), 0)
+
+    def test_unread_badge(self):
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        now = datetime.now(timezone.utc)
+        db.session.add_all([Message(author=users[0], recipient=users[2], body=f'Сообщение {i}',
+                                    timestamp=now + timedelta(seconds=i)) for i in range(3)])
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(users[2].id)
+        with self.app.app_context():
+            client.get('/messages')
+        db.session.expire_all()
+        self.assertEqual(users[2].unread_message_count(), 3)
+        self.assertEqual(ConversationMember.find(users[2].id, users[0].id).unread_count, 3)
+
+        db.session.add(Message(author=users[1], recipient=users[2], body='Привет', timestamp=now + timedelta(seconds=5)))
+        db.session.commit()
+        self.assertEqual(users[2].unread_message_count(), 4)
+        with self.app.app_context():
+            client.get('/messages/user0')
+        db.session.expire_all()
+        self.assertEqual(users[2].unread_message_count(), 1)
+        self.assertEqual(ConversationMember.find(users[2].id, users[1].id).unread_count, 1)
+        notification = db.session.scalar(users[2].notifications.select().filter_by(name='unread_message_count'))
+        self.assertEqual(notification.get_data(), 1)
+
+        users[2].read_messages()
+        db.session.commit()
+        self.assertEqual(ConversationMember.find(users[2].id, users[1].id).unread_count, 0)
+        User.reconcile_counters()
+        db.session.commit()
+        self.assertEqual(users[2].unread_message_count(), 0)
+
+    def test_group_broadcast(self):
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(6)]
+        group = Group(name='Группа')
+        db.session.add_all(users + [group])
+        db.session.flush()
+        db.session.add_all([Membership(user=user, group=group) for user in users[:5]])
+        db.session.add(Message(author=users[1], recipient=users[0], body='Привет'))
+        db.session.commit()
+
+        sent, _ = broadcast(group.id, users[0].id, 'Всем привет', chunk_size=3)
+        self.assertEqual(sent, 4)
+        received = db.session.scalars(sa.select(Message.recipient_id).filter_by(body='Всем привет')).all()
+        self.assertEqual(sorted(received), [user.id for user in users[1:5]])
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Conversation)), 4)
+        db.session.expire_all()
+        self.assertEqual([user.unread_message_count() for user in users], [1, 1, 1, 1, 1, 0])
+        member = ConversationMember.find(users[1].id, users[0].id)
+        self.assertEqual(member.unread_count, 1)
+        self.assertEqual(db.session.get(Message, member.last_message_id).body, 'Всем привет')
+        self.assertEqual(ConversationMember.find(users[0].id, users[1].id).unread_count, 1)
+        self.assertEqual(ConversationMember.find(users[0].id, users[4].id).unread_count, 0)
+        notifications = db.session.scalars(sa.select(Notification).order_by(Notification.user_id)).all()
+        self.assertEqual([(n.user_id, n.get_data()) for n in notifications], [(user.id, 1) for user in users[1:5]])
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(users[5].id)
+        with self.app.app_context():
+            response = client.post(f'/groups/{group.id}/broadcast', json={'body': 'Привет'})
+        self.assertEqual(response.status_code, 403)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(users[0].id)
+        with self.app.app_context():
+            response = client.post(f'/groups/{group.id}/broadcast', json={'body': ''})
+        self.assertEqual(response.status_code, 422)
+        with self.app.app_context():
+            response = client.post(f'/groups/{group.id}/broadcast', json={'body': 'Еще раз'})
+        self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        self.assertEqual(users[1].unread_message_count(), 2)
+
+    def test_search_outbox(self):
+        class FakeElasticsearch:
+            def __init__(self):
+                self.calls = []
+                self.indices = type('FakeIndices', (), {'exists_alias': lambda self, name: False})()
+
+            def bulk(self, operations):
+                self.calls.append(operations)
+                items = [{action: {'_index': meta['_index'], '_id': str(meta['_id']), 'status': 200}}
+                         for entry in operations for action, meta in entry.items() if action in ('index', 'delete')]
+                for item in items:
+                    for action, result in item.items():
+                        if action == 'delete':
+                            result.update(status=404, error={'type': 'not_found'})
+                        elif result['_id'] == '2':
+                            result.update(status=400, error={'type': 'mapper_parsing_exception'})
+                return {'errors': True, 'items': items}
+
+        self.app.elasticsearch = FakeElasticsearch()
+        self.app.config['ELASTICSEARCH_BULK_SIZE'] = 2
+        user = User(username='Иван', email='ivan@example.com')
+        posts = [Post(body=f'Пост {i}', author=user) for i in range(3)]
+        db.session.add_all([user] + posts)
+        db.session.commit()
+        self.assertEqual(self.app.elasticsearch.calls, [])
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(SearchOutbox)), 3)
+
+        self.assertEqual(drain_search_outbox(), 2)
+        self.assertEqual(len(self.app.elasticsearch.calls), 2)
+        self.assertEqual(self.app.elasticsearch.calls[0][:2], [{'index': {'_index': 'post', '_id': 1}},
+                                                               {'body': 'Пост 0'}])
+        retry = db.session.scalar(sa.select(SearchOutbox))
+        self.assertEqual((retry.document_id, retry.attempts), (2, 1))
+        self.assertGreater(retry.available_at, datetime.now(timezone.utc).replace(tzinfo=None))
+
+        self.app.elasticsearch.calls.clear()
+        posts[0].body = 'Изменено'
+        db.session.commit()
+        posts[0].body = 'Изменено еще раз'
+        posts[2].author = user
+        db.session.delete(posts[1])
+        db.session.commit()
+        retry.available_at = datetime.now(timezone.utc)
+        db.session.commit()
+        self.assertEqual(drain_search_outbox(), 2)
+        self.assertEqual(self.app.elasticsearch.calls, [[{'delete': {'_index': 'post', '_id': 2}},
+                                                         {'index': {'_index': 'post', '_id': 1}},
+                                                         {'body': 'Изменено еще раз'}]])
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(SearchOutbox)), 0)
+
+    def test_search_reindex(self):
+        class FakeIndices:
+            def __init__(self):
+                self.calls = []
+                self.aliases = set()
+
+            def created(self):
+                return [kwargs['index'] for name, kwargs in self.calls if name == 'create'][-1]
+
+            def resolve(self, name):
+                return next((index for index, alias in self.aliases if alias == name), name)
+
+            def __getattr__(self, name):
+                def call(**kwargs):
+                    self.calls.append((name, kwargs))
+                    if name == 'exists_alias':
+                        return any(alias == kwargs['name'] for index, alias in self.aliases)
+                    if name == 'get_alias':
+                        return {index: {} for index, alias in self.aliases if alias == kwargs['name']}
+                    if name == 'exists':
+                        return True
+                    if name == 'create':
+                        self.aliases |= {(kwargs['index'], alias) for alias in kwargs.get('aliases', {})}
+                    if name == 'delete':
+                        self.aliases = {(index, alias) for index, alias in self.aliases if index != kwargs['index']}
+                    if name == 'update_aliases':
+                        for action in kwargs['actions']:
+                            if 'add' in action:
+                                self.aliases.add((action['add']['index'], action['add']['alias']))
+                            if 'remove' in action:
+                                self.aliases.discard((action['remove']['index'], action['remove']['alias']))
+                return call
+
+        class FakeElasticsearch:
+            def __init__(self):
+                self.indices = FakeIndices()
+                self.documents = []
+                self.rejected = set()
+                self.on_create = None
+
+            def bulk(self, operations):
+                if self.rejected is None:
+                    raise RuntimeError('connection lost')
+                items = []
+                for entry in operations:
+                    if not any(action in entry for action in ('index', 'create', 'delete')):
+                        continue
+                    action, meta = next(iter(entry.items()))
+                    index = self.indices.resolve(meta['_index'])
+                    self.documents.append((action, index, meta['_id']))
+                    result = {'_index': index, '_id': str(meta['_id']), 'status': 200}
+                    if meta['_id'] in self.rejected:
+                        result.update(status=400, error={'type': 'mapper_parsing_exception'})
+                    items.append({action: result})
+                    if action == 'create' and self.on_create:
+                        self.on_create(meta['_id'])
+                return {'errors': any('error' in item[action] for item in items for action in item), 'items': items}
+
+        user = User(username='Иван', email='ivan@example.com')
+        db.session.add_all([user] + [Post(body=f'Пост {i}', author=user) for i in range(5)])
+        db.session.commit()
+        self.app.elasticsearch = FakeElasticsearch()
+        self.app.extensions.pop('search_backend', None)
+        self.app.config.update(ELASTICSEARCH_BULK_SIZE=2, SEARCH_REINDEX_RANGE_SIZE=3)
+        es, indices = self.app.elasticsearch, self.app.elasticsearch.indices
+
+        self.assertEqual(Post.reindex(), (5, []))
+        target = indices.created()
+        create = next(kwargs for name, kwargs in indices.calls if name == 'create')
+        self.assertEqual((create['settings'], create['aliases']), ({'index': {'refresh_interval': '-1'}},
+                                                                  {'post-rebuild': {}}))
+        self.assertEqual(es.documents, [('create', target, id) for id in range(1, 6)])
+        self.assertIn(('update_aliases', {'actions': [{'add': {'index': target, 'alias': 'post'}},
+                                                      {'remove': {'index': target, 'alias': 'post-rebuild'}},
+                                                      {'remove_index': {'index': 'post'}}]}), indices.calls)
+        self.assertEqual(indices.aliases, {(target, 'post')})
+
+        def delete_during_rebuild(id):
+            if id == 3:
+                es.on_create = None
+                db.session.delete(db.session.get(Post, 1))
+                db.session.commit()
+                drain_search_outbox()
+
+        indices.calls.clear()
+        es.documents.clear()
+        es.on_create = delete_during_rebuild
+        self.assertEqual(Post.reindex(), (4, []))
+        rebuilt = indices.created()
+        self.assertEqual(indices.aliases, {(rebuilt, 'post')})
+        self.assertIn(('delete', {'index': target}), indices.calls)
+        self.assertIn(('delete', target, 1), es.documents)
+        self.assertEqual(es.documents.count(('delete', rebuilt, 1)), 2)
+        self.assertEqual(es.documents[-1], ('create', rebuilt, 5))
+
+        current = set(indices.aliases)
+        indices.calls.clear()
+        es.rejected = {2}
+        count, errors = Post.reindex()
+        self.assertEqual((count, [error['id'] for error in errors]), (4, ['2']))
+        self.assertEqual(indices.aliases, current)
+        self.assertNotIn('update_aliases', [name for name, kwargs in indices.calls])
+        self.assertEqual([call for call in indices.calls if call[0] == 'delete'],
+                         [('delete', {'index': indices.created()})])
+
+        indices.calls.clear()
+        es.rejected = None
+        with self.assertRaises(RuntimeError):
+            Post.reindex()
+        self.assertEqual(indices.aliases, current)
+        self.assertEqual(indices.calls[-1], ('delete', {'index': indices.created()}))
+
+    def test_database_search(self):
+        user = User(username='Иван', email='ivan@example.com')
+        posts = [Post(body='Привет, мир!', author=user), Post(body='мир мир мир', author=user),
+                 Post(body='Прощай', author=user)]
+        db.session.add_all([user] + posts)
+        db.session.commit()
+        found, total = Post.search('МИР', 1, 10)
+        self.assertEqual((list(found), total), ([posts[1], posts[0]], 2))
+        found, total = Post.search('мир', 2, 1)
+        self.assertEqual((list(found), total), ([posts[0]], 2))
+        self.assertEqual(Post.search('"мир" OR (прощай', 1, 10)[1], 3)
+        self.assertEqual(Post.search('!!!', 1, 10), ([], 0))
+
+        posts[2].body = 'Прощай, мир'
+        db.session.delete(posts[1])
+        db.session.commit()
+        found, total = Post.search('мир', 1, 10)
+        self.assertEqual(sorted(post.id for post in found), [posts[0].id, posts[2].id])
+        db.session.add(Post(body='Новый мир', author=user))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(Post.search('новый', 1, 10), ([], 0))
+
+        db.session.execute(sa.text('DELETE FROM post_fts'))
+        self.assertEqual(query_index('post', 'мир', 1, 10), ([], 0))
+        self.assertEqual(Post.reindex(), (2, []))
+        self.assertEqual(Post.search('мир', 1, 10)[1], 2)
+
+    def test_search_cache(self):
+        user = User(username='Иван', email='ivan@example.com')
+        db.session.add_all([user, Post(body='Привет, мир', author=user)])
+        db.session.commit()
+        found, total = Post.search('  МИР ', 1, 10)
+        self.assertEqual((found[0].author, total), (user, 1))
+
+        db.session.execute(sa.text('DELETE FROM post_fts'))
+        self.assertEqual(Post.search('мир', 1, 10)[1], 1)
+        self.assertEqual(Post.search('мир', 2, 10), ([], 0))
+        db.session.add(Post(body='Новый мир', author=user))
+        db.session.commit()
+        self.assertEqual(Post.search('мир', 1, 10)[1], 1)
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        with self.app.app_context():
+            response = client.get('/search?q=мир')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Новый мир', response.get_data(as_text=True))
+
+    def test_username_autocomplete(self):
+        self.app.extensions['username_index'] = UsernameIndex(300, 10, memo_range=1)
+        users = [User(username=name, email=f'{name}@example.com') for name in ('Анна', 'анатолий', 'Андрей', 'Борис')]
+        db.session.add_all(users)
+        db.session.commit()
+        users[2].follow(users[0])
+        users[3].follow(users[0])
+        users[3].follow(users[1])
+        db.session.commit()
+        self.assertEqual([match[1] for match in complete_usernames('АН', 10)], ['Анна', 'анатолий', 'Андрей'])
+        self.assertEqual([match[1] for match in complete_usernames('ан', 1)], ['Анна'])
+        self.assertEqual(complete_usernames('я', 10), [])
+
+        users[3].username = 'Антон'
+        db.session.add(User(username='Ангелина', email='angelina@example.com'))
+        db.session.commit()
+        self.assertEqual([match[1] for match in complete_usernames('ан', 10)],
+                         ['Анна', 'анатолий', 'Ангелина', 'Андрей', 'Антон'])
+        self.assertEqual(complete_usernames('б', 10), [])
+
+        index = username_index()
+        index.loaded_at -= index.ttl
+        with index.reload_lock:
+            self.assertEqual(len(complete_usernames('ан', 10)), 5)
+        self.assertFalse(index.is_warm())
+        complete_usernames('ан', 10)
+        self.assertTrue(index.is_warm())
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(users[0].id)
+        with self.app.app_context():
+            response = client.get('/users/autocomplete?q=анн')
+        self.assertEqual(response.get_json(), {'users': [{'id': users[0].id, 'username': 'Анна', 'follower_count': 2}]})
+
+    def test_translation_cache(self):
+        self.assertEqual(translate_many(['Привет', 'Мир', 'Привет'], 'ru', 'en'),
+                         ['[en] Привет', '[en] Мир', '[en] Привет'])
+        self.assertEqual(translate('Мир', 'ru', 'en'), '[en] Мир')
+        self.assertEqual(translate('Мир', 'ru', 'de'), '[de] Мир')
+        self.assertEqual(translator().requests, [['Привет', 'Мир'], ['Мир']])
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Translation)), 3)
+
+        user = User(username='Иван', email='ivan@example.com')
+        db.session.add(user)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        with self.app.app_context():
+            response = client.post('/translate', json={'texts': ['Привет', 'Пока'], 'source_language': 'ru',
+                                                       'dest_language': 'en'})
+            self.assertEqual(response.get_json(), {'texts': ['[en] Привет', '[en] Пока']})
+            response = client.post('/translate', json={'text': 'Пока', 'source_language': 'ru' * 10,
+                                                       'dest_language': 'en'})
+            self.assertEqual(response.status_code, 400)
+            for body in ({'source_language': 'ru', 'dest_language': 'en'},
+                         {'text': ['Пока'], 'source_language': 'ru', 'dest_language': 'en'}, ['Пока']):
+                self.assertEqual(client.post('/translate', json=body).status_code, 400)
+        self.assertEqual(translator().requests[-1], ['Пока'])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)